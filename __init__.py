@@ -1,2 +1,27 @@
-from .gmx import *
-from utils.gmx import mdps
+# Package facade. Nothing heavy is imported up front: the functions of gmx.py
+#  (grompp, mdrun, simulate, ...) and the submodules are loaded on first
+#  use, so short scripts and worker processes start quickly. Any other name
+#  is looked up as a gmx tool, e.g. utils.gmx.trjconv(f = ..., o = ...).
+
+import importlib
+
+_SUBMODULES = ["gmx", "xvg", "mdlog", "tune", "selection", "cache", "objects",
+               "topology", "mdps", "plot_xvg"]
+
+def __getattr__(name):
+  if name in _SUBMODULES:
+    return importlib.import_module("." + name, __name__)
+  if name.startswith("__") and name != "__all__":
+    raise AttributeError("module {} has no attribute {}".format(__name__, name))
+
+  gmx = importlib.import_module(".gmx", __name__)
+  if name == "__all__":
+    # what "from .gmx import *" used to export, plus mdps
+    return [n for n in dir(gmx) if not n.startswith("_")] + ["mdps"]
+
+  value = getattr(gmx, name)
+  globals()[name] = value
+  return value
+
+def __dir__():
+  return sorted(set(globals()) | set(_SUBMODULES) | set(__getattr__("__all__")))
@@ -0,0 +1,318 @@
+# Wall time and peak memory of the file parsers and writers on synthetic
+#  inputs. Inputs are generated once per size into a work directory (by
+#  default the gmxTools cache) and reused; every case runs in a fresh process
+#  so its peak memory isn't hidden by an earlier case. Results are written as
+#  json and can be compared against a stored baseline:
+#
+#    python bench_parsers.py --size realistic --save baseline.json
+#    python bench_parsers.py --size realistic --baseline baseline.json
+#
+#  The second call exits with status 1 if any case got slower or bigger than
+#  the baseline by more than --tolerance.
+
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import subprocess
+import numpy as np
+from argparse import ArgumentParser as AP
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+# "extreme" is the size of the largest inputs we see in practice
+SIZES = {
+  "small":     dict(xvg_rows = 10 ** 4, xvg_cols = 5, ndx_atoms = 10 ** 4, mdp_keys = 100,
+                    mdp_files = 10, log_bytes = 10 ** 6, dihedrals = 500, tabulated = 10),
+  "realistic": dict(xvg_rows = 10 ** 6, xvg_cols = 5, ndx_atoms = 10 ** 5, mdp_keys = 300,
+                    mdp_files = 100, log_bytes = 10 ** 7, dihedrals = 5000, tabulated = 50),
+  "extreme":   dict(xvg_rows = 10 ** 7, xvg_cols = 5, ndx_atoms = 10 ** 6, mdp_keys = 5000,
+                    mdp_files = 2000, log_bytes = 10 ** 9, dihedrals = 50000, tabulated = 500),
+}
+
+# ---------------------------------------------------------------------------- #
+# Input generators. Each writes its input(s) under d and returns the
+#  arguments of the matching case.
+
+def make_xvg(d, n):
+  path = os.path.join(d, "data.xvg")
+  if not os.path.isfile(path):
+    rng = np.random.default_rng(0)
+    with open(path + ".tmp", 'w') as f:
+      f.write("# synthetic gmx energy output\n@    title \"GROMACS Energies\"\n")
+      f.write("@    xaxis  label \"Time (ps)\"\n@    yaxis  label \"(kJ/mol)\"\n@TYPE xy\n")
+      for i in range(n["xvg_cols"] - 1):
+        f.write("@ s{} legend \"Term {}\"\n".format(i, i))
+      for start in range(0, n["xvg_rows"], 10 ** 6):
+        rows = min(10 ** 6, n["xvg_rows"] - start)
+        data = rng.normal(size = (rows, n["xvg_cols"])) * 1000
+        data[:, 0] = np.arange(start, start + rows) * 0.002
+        np.savetxt(f, data, fmt = "%14.6f")
+    os.replace(path + ".tmp", path)
+  return [path]
+
+
+def make_ndx(d, n):
+  path = os.path.join(d, "index.ndx")
+  if not os.path.isfile(path):
+    atoms  = np.arange(1, n["ndx_atoms"] + 1)
+    groups = {"System": atoms, "Protein": atoms[:len(atoms) // 10],
+              "Water": atoms[len(atoms) // 10:], "Backbone": atoms[:len(atoms) // 10:4]}
+    with open(path + ".tmp", 'w') as f:
+      for name, idx in groups.items():
+        f.write("[ {} ]\n".format(name))
+        full = len(idx) - len(idx) % 15
+        np.savetxt(f, idx[:full].reshape(-1, 15), fmt = "%4d")
+        if full < len(idx):
+          np.savetxt(f, idx[None, full:], fmt = "%4d")
+    os.replace(path + ".tmp", path)
+  return [path]
+
+
+def make_mdp(d, n):
+  path = os.path.join(d, "params.mdp")
+  if not os.path.isfile(path):
+    with open(path + ".tmp", 'w') as f:
+      f.write("; synthetic mdp\n")
+      for i in range(n["mdp_keys"]):
+        f.write("key-{:<20d} = {} {}\n".format(i, i * 0.5, "yes" if i % 2 else "no"))
+    os.replace(path + ".tmp", path)
+  return [path, os.path.join(d, "written.mdp")]
+
+
+def make_mdp_list(d, n):
+  path = os.path.join(d, "mdps.txt")
+  if not os.path.isfile(path):
+    mdp = make_mdp(d, dict(n, mdp_keys = 50))[0]
+    os.makedirs(os.path.join(d, "mdps"), exist_ok = True)
+    with open(path + ".tmp", 'w') as f:
+      for i in range(n["mdp_files"]):
+        name = os.path.join("mdps", "step{}.mdp".format(i))
+        if not os.path.isfile(os.path.join(d, name)):
+          with open(mdp) as src, open(os.path.join(d, name), 'w') as dst:
+            dst.write(src.read())
+        f.write(name + "\n")
+    os.replace(path + ".tmp", path)
+  return [path]
+
+
+def make_log(d, n):
+  """ A gmx stderr capture: the command line, n bytes of progress and notes,
+      then a fatal error at the very end. """
+  path = os.path.join(d, "stderr.txt")
+  if not os.path.isfile(path):
+    line  = "step {:>10d}, will finish Thu Oct 15 12:00:00 2026 imb F  2% pme/F 0.91\n"
+    block = "".join(line.format(i) for i in range(10 ** 4))
+    with open(path + ".tmp", 'w') as f:
+      f.write("                      :-) GROMACS - gmx mdrun, 2018 (-:\n\n")
+      f.write("Command line:\n  gmx mdrun -deffnm md\n\n")
+      for i in range(max(n["log_bytes"] // len(block), 1)):
+        f.write(block)
+      f.write("\n-------------------------------------------------------\n")
+      f.write("Program:     gmx mdrun, version 2018\n\nFatal error:\n")
+      f.write("There is no domain decomposition for 8 ranks\n\n")
+    os.replace(path + ".tmp", path)
+  return [path]
+
+
+def make_top(d, n):
+  path = os.path.join(d, "system.top")
+  if not os.path.isfile(path):
+    n_atoms = n["dihedrals"] + 3
+    with open(path + ".tmp", 'w') as f:
+      f.write("[ defaults ]\n  1  2  yes  0.5  0.8333\n\n")
+      f.write("[ moleculetype ]\nCHAIN  3\n\n[ atoms ]\n")
+      for i in range(1, n_atoms + 1):
+        f.write("{:>6d}  CT  1  ALK  C{:<4d} {:>6d}  0.000  12.011\n".format(i, i % 10000, i))
+      f.write("\n[ bonds ]\n")
+      for i in range(1, n_atoms):
+        f.write("{:>6d}{:>7d}  1\n".format(i, i + 1))
+      f.write("\n[ dihedrals ]\n")
+      for i in range(1, n["dihedrals"] + 1):
+        f.write("{:>6d}{:>7d}{:>7d}{:>7d}  9\n".format(i, i + 1, i + 2, i + 3))
+      f.write("\n[ system ]\nchain\n\n[ molecules ]\nCHAIN  1\n")
+    os.replace(path + ".tmp", path)
+  step    = max(n["dihedrals"] // n["tabulated"], 1)
+  d_lists = [[i, i + 1, i + 2, i + 3] for i in range(1, n["dihedrals"] + 1, step)]
+  return [path, d_lists, ["table"] * len(d_lists), os.path.join(d, "tabulated.top")]
+
+# ---------------------------------------------------------------------------- #
+# The cases. Each runs in its own process, importing only what it needs.
+
+def run_xvg(path):
+  from utils.gmx.xvg import xvg
+  return xvg(path).data.shape
+
+def run_ndx(path):
+  from utils.gmx.objects.ndx import ndx
+  return len(ndx(path)["System"])
+
+def run_ndx_write(path):
+  from utils.gmx.objects.ndx import ndx
+  groups = ndx(path)
+  start  = time.perf_counter() # only the write is timed
+  groups.write(path + ".out")
+  return time.perf_counter() - start
+
+def run_mdp_load(path, out):
+  from utils.gmx.objects.mdp import mdp
+  return len(mdp(path))
+
+def run_mdp_write(path, out):
+  from utils.gmx.objects.mdp import mdp
+  m = mdp(path)
+  start = time.perf_counter() # only the write is timed
+  m.write(out)
+  return time.perf_counter() - start
+
+def run_mdp_list(path):
+  from utils.gmx.gmx import load_mdp_list
+  return len(load_mdp_list(path))
+
+def run_check_for_error(path):
+  from utils.gmx.gmx import check_for_error, GROMACSFatalError
+  try:
+    check_for_error(path)
+  except GROMACSFatalError:
+    return "raised"
+  return "missed"
+
+def run_tabulate(top, d_lists, tables, out):
+  from utils.gmx.topology.dihedrals import tabulate_in_topology
+  return tabulate_in_topology(top, d_lists, tables, path = out).count(" ") + 1
+
+CASES = [
+  ("xvg.load",             make_xvg,      run_xvg),
+  ("ndx.load",             make_ndx,      run_ndx),
+  ("ndx.write",            make_ndx,      run_ndx_write),
+  ("mdp.load",             make_mdp,      run_mdp_load),
+  ("mdp.write",            make_mdp,      run_mdp_write),
+  ("load_mdp_list",        make_mdp_list, run_mdp_list),
+  ("check_for_error",      make_log,      run_check_for_error),
+  ("tabulate_in_topology", make_top,      run_tabulate),
+]
+
+# ---------------------------------------------------------------------------- #
+
+def _measure(func, args):
+  """ Runs func(*args) in this (fresh) process. Returns the wall time and
+      the growth of the peak resident set size it caused, in MB.
+  """
+  import resource
+  before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  start  = time.perf_counter()
+  value  = func(*args)
+  wall   = time.perf_counter() - start
+  peak   = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  if func in (run_mdp_write, run_ndx_write):
+    wall = value
+  return wall, (peak - before) / 1024, peak / 1024
+
+
+def run(size = "realistic", workdir = None, cases = None, repeats = 1):
+  """ Runs the benchmarks at one size. Returns the result record. """
+
+  n       = SIZES[size]
+  workdir = workdir if workdir else _default_workdir(size)
+  os.makedirs(workdir, exist_ok = True)
+
+  results = {}
+  for name, make, func in CASES:
+    if cases and name not in cases:
+      continue
+    start = time.perf_counter()
+    args  = make(workdir, n)
+    print("{:<22s} input ready ({:.1f} s)".format(name, time.perf_counter() - start), file = sys.stderr)
+
+    runs = []
+    for r in range(repeats):
+      with ProcessPoolExecutor(max_workers = 1, mp_context = get_context("spawn"),
+                               initializer = _preload, initargs = (func.__name__,)) as pool:
+        try:
+          runs.append(pool.submit(_measure, func, args).result())
+        except ImportError as e:
+          results[name] = {"skipped": str(e)}
+          break
+        except Exception as e:
+          results[name] = {"error": repr(e)}
+          break
+    if runs:
+      wall, peak, rss = min(runs)
+      results[name] = {"wall_s": round(wall, 4), "peak_mb": round(peak, 1), "rss_mb": round(rss, 1)}
+    print("{:<22s} {}".format(name, results[name]), file = sys.stderr)
+
+  return {"meta": _meta(size, repeats), "results": results}
+
+
+def _preload(name):
+  """ Imports a case's modules in the worker before it is measured. """
+  modules = {"run_xvg": ["utils.gmx.xvg"], "run_ndx": ["utils.gmx.objects.ndx"],
+             "run_ndx_write": ["utils.gmx.objects.ndx"],
+             "run_tabulate": ["utils.gmx.topology.dihedrals"]}
+  for module in modules.get(name, ["utils.gmx.gmx"]):
+    try:
+      __import__(module)
+    except ImportError:
+      pass # reported when the case runs
+
+
+def compare(results, baseline, tolerance = 0.2):
+  """ Cases that got slower or use more memory than the baseline by more
+      than tolerance (relative). Memory changes below 1 MB are ignored.
+  """
+  regressions = []
+  for name, new in results["results"].items():
+    old = baseline["results"].get(name)
+    if not old or "wall_s" not in old or "wall_s" not in new:
+      continue
+    if new["wall_s"] > old["wall_s"] * (1 + tolerance):
+      regressions.append("{}: wall time {:.3f} s -> {:.3f} s".format(name, old["wall_s"], new["wall_s"]))
+    if new["peak_mb"] > old["peak_mb"] * (1 + tolerance) + 1:
+      regressions.append("{}: peak memory {:.1f} MB -> {:.1f} MB".format(name, old["peak_mb"], new["peak_mb"]))
+  return regressions
+
+
+def _default_workdir(size):
+  from utils.gmx import cache as Cache
+  return Cache.cache_dir(os.path.join("bench", size))
+
+
+def _meta(size, repeats):
+  try:
+    commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output = True,
+                            text = True, cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+  except OSError:
+    commit = None
+  return {"size": size, "sizes": SIZES[size], "repeats": repeats, "commit": commit,
+          "date": time.strftime("%Y-%m-%d %H:%M:%S"), "host": socket.gethostname(),
+          "cpus": os.cpu_count(), "python": platform.python_version(), "numpy": np.__version__}
+
+# ---------------------------------------------------------------------------- #
+
+if __name__ == "__main__":
+  parser = AP("Benchmark the gmxTools file parsers and writers.")
+  parser.add_argument("-s", "--size", default = "realistic", choices = list(SIZES))
+  parser.add_argument("-c", "--cases", nargs = "+", default = None, choices = [c[0] for c in CASES])
+  parser.add_argument("-r", "--repeats", type = int, default = 1, help = "best of this many runs")
+  parser.add_argument("-w", "--workdir", default = None, help = "where the synthetic inputs are kept")
+  parser.add_argument("-o", "--out", default = None, help = "write the results to this json file")
+  parser.add_argument("--save", default = None, help = "write the results as a new baseline")
+  parser.add_argument("-b", "--baseline", default = None, help = "compare against this baseline")
+  parser.add_argument("-t", "--tolerance", type = float, default = 0.2)
+  d = parser.parse_args()
+
+  results = run(d.size, d.workdir, d.cases, d.repeats)
+  for path in [d.out, d.save]:
+    if path:
+      with open(path, 'w') as f:
+        json.dump(results, f, indent = 1)
+  print(json.dumps(results["results"], indent = 1))
+
+  if d.baseline:
+    with open(d.baseline) as f:
+      regressions = compare(results, json.load(f), d.tolerance)
+    for r in regressions:
+      print("REGRESSION " + r)
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# Stand-in for the gmx executable, for exercising and benchmarking the run
+#  machinery (tune.tune_mdrun, mdrun_segments, simulate_many) on machines
+#  without GROMACS. "mdrun" sleeps for a modeled wall time that depends on
+#  -nt, -dds, -pforce and -nb, then writes a log with the usual performance
+#  section, an edr frame and a checkpoint holding the step reached. It
+#  resumes from -cpi and stops early when the modeled time exceeds -maxh,
+#  like mdrun does. "grompp" writes a tpr made of its inputs and copies the
+#  mdp to -po. Usage, e.g.:
+#    tune_mdrun("x.tpr", executable = "python benchmarks/gmx_standin.py")
+#  GMX_STANDIN_SCALE scales the sleep (default 1e-5 s per modeled step).
+
+import os
+import sys
+import time
+import struct
+
+DT     = 0.002 # ps
+MAGIC1 = 171817
+MAGIC2 = 171819
+
+def flags(argv):
+  """ -flag value pairs of a gmx command line (bare flags map to True). """
+  out, i = {}, 0
+  while i < len(argv):
+    if argv[i].startswith("-"):
+      value = argv[i + 1] if i + 1 < len(argv) and not argv[i + 1].startswith("-") else True
+      out[argv[i][1:]] = value
+      i += 1 if value is True else 2
+    else:
+      i += 1
+  return out
+
+def step_cost(f, cores):
+  """ Modeled seconds per step: parallel speedup that flattens out with
+      thread count, with penalties for oversubscription and imbalance.
+  """
+  nt      = int(f.get("nt", cores))
+  speedup = nt ** 0.85 if nt <= cores else cores ** 0.85 * (cores / nt) ** 2
+  cost    = 1.0 / speedup
+  if f.get("dds") not in (None, True):
+    cost *= 1.0 - 0.05 * (float(f["dds"]) - 0.8) * 10 if nt >= 4 else 1.02
+  if f.get("nb") == "gpu":
+    cost *= 1.5 # no GPU here
+  if f.get("pforce") not in (None, True):
+    cost *= 1.01
+  return cost
+
+def fatal(message):
+  sys.stderr.write("\nFatal error:\n{}\n\n".format(message))
+  sys.exit(1)
+
+def read_checkpoint(path):
+  """ The step stored in a stand-in checkpoint. """
+  with open(path, 'rb') as cpt:
+    data = cpt.read()
+  if len(data) != 16 or struct.unpack(">iqi", data)[::2] != (MAGIC1, MAGIC2):
+    fatal("Checkpoint file {} is corrupted or truncated.".format(path))
+  return struct.unpack(">iqi", data)[1]
+
+def write_checkpoint(deffnm, step):
+  """ Keeps the previous checkpoint as deffnm_prev.cpt, as mdrun does. """
+  if os.path.isfile(deffnm + ".cpt"):
+    os.replace(deffnm + ".cpt", deffnm + "_prev.cpt")
+  with open(deffnm + ".cpt", 'wb') as cpt:
+    cpt.write(struct.pack(">iqi", MAGIC1, step, MAGIC2))
+
+def write_energy(deffnm, step, append):
+  """ One single precision edr frame at step, holding a "Potential" term. """
+  with open(deffnm + ".edr", 'ab' if append else 'wb') as edr:
+    if not append:
+      edr.write(struct.pack(">iii", -55555, 5, 1))
+      for name in [b"Potential", b"kJ/mol"]:
+        edr.write(struct.pack(">I", len(name)) + name + b"\0" * (-len(name) % 4))
+    edr.write(struct.pack(">fii", -2e10, -7777777, 5))
+    edr.write(struct.pack(">dqiqd", step * DT, step, 0, 1, DT))
+    edr.write(struct.pack(">iiiiiif", 1, 0, 0, 0, 0, 0, -1000.0))
+
+def mdrun(f):
+  deffnm = f.get("deffnm", "md")
+  nsteps = int(f.get("nsteps", 1000))
+  cores  = os.cpu_count()
+  nt     = int(f.get("nt", cores))
+  scale  = float(os.environ.get("GMX_STANDIN_SCALE", 1e-5))
+  append = f.get("append") == "yes"
+
+  # Continue from the checkpoint, and run as many steps as -maxh allows
+  #  (one modeled step costs step_cost seconds)
+  first = read_checkpoint(f["cpi"]) if f.get("cpi") not in (None, True) else 0
+  last  = nsteps
+  if f.get("maxh") not in (None, True):
+    last = min(nsteps, first + int(float(f["maxh"]) * 3600 / step_cost(f, cores)))
+  nsteps = last - first
+
+  start = time.time()
+  time.sleep(nsteps * step_cost(f, cores) * scale)
+  wall  = max(time.time() - start, 1e-6)
+  if f.get("resethway") == "yes":
+    wall /= 2
+    nsteps //= 2
+  ns_per_day = nsteps * DT / 1000 / wall * 86400
+
+  mode = 'a' if append else 'w'
+  with open(deffnm + ".log", mode) as log:
+    log.write("Started mdrun on rank 0 {}\n".format(time.ctime(start)))
+    if last < int(f.get("nsteps", 1000)):
+      log.write("\nStep {}: Run time exceeded {:.3f} hours, will terminate the run\n".format(last, float(f["maxh"]) * 0.99))
+    log.write("\n M E G A - F L O P S   A C C O U N T I N G\n\n")
+    log.write(" Average load imbalance: {:.1f} %\n".format(2.0 + nt * 0.1))
+    log.write(" Part of the total run time spent waiting due to load imbalance: {:.1f} %\n\n".format(nt * 0.05))
+    log.write("     R E A L   C Y C L E   A N D   T I M E   A C C O U N T I N G\n\n")
+    log.write("On 1 MPI rank, each using {} OpenMP threads\n\n".format(nt))
+    log.write(" Computing:          Num   Num      Call    Wall time         Giga-Cycles\n")
+    log.write("                     Ranks Threads  Count      (s)         total sum    %\n")
+    log.write("-" * 77 + "\n")
+    for name, share in [("Neighbor search", 0.05), ("Force", 0.80), ("PME mesh", 0.12), ("Rest", 0.03)]:
+      counts = "    1 {:4d} {:10d}".format(nt, nsteps) if name != "Rest" else " " * 21
+      log.write(" {:<18}{} {:11.3f} {:14.3f} {:5.1f}\n".format(name, counts, wall * share, wall * share * 2.5 * nt, share * 100))
+    log.write("-" * 77 + "\n")
+    log.write(" {:<39} {:11.3f} {:14.3f} {:5.1f}\n".format("Total", wall, wall * 2.5 * nt, 100.0))
+    log.write("-" * 77 + "\n\n")
+    log.write("               Core t (s)   Wall t (s)        (%)\n")
+    log.write("       Time: {:12.3f} {:12.3f} {:10.1f}\n".format(wall * nt, wall, nt * 100.0))
+    log.write("                 (ns/day)    (hour/ns)\n")
+    log.write("Performance: {:12.3f} {:12.3f}\n".format(ns_per_day, 24 / ns_per_day))
+    log.write("Finished mdrun on rank 0 {}\n".format(time.ctime()))
+
+  write_energy(deffnm, last, append)
+  write_checkpoint(deffnm, last)
+
+def grompp(f):
+  """ A "tpr" holding the mdp, coordinates and topology it was built from. """
+  with open(f.get("o", "topol.tpr"), 'wb') as tpr:
+    for flag in ["f", "c", "p"]:
+      with open(f[flag], 'rb') as src:
+        tpr.write(src.read())
+  with open(f["f"], 'rb') as src, open(f.get("po", "mdout.mdp"), 'wb') as po:
+    po.write(src.read())
+
+if __name__ == "__main__":
+  sys.stderr.write("Command line:\n  gmx {}\n\n".format(" ".join(sys.argv[1:])))
+  if len(sys.argv) > 1 and sys.argv[1] == "mdrun":
+    mdrun(flags(sys.argv[2:]))
+  elif len(sys.argv) > 1 and sys.argv[1] == "grompp":
+    grompp(flags(sys.argv[2:]))
+  else:
+    fatal("The stand-in only implements mdrun and grompp.")
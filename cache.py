@@ -0,0 +1,119 @@
+# Small on-disk cache helpers shared by the parsers. Entries are keyed on the
+#  size, mtime and content hash of their source files, and a cache directory
+#  is trimmed least-recently-used first once it grows past its size budget.
+
+import os
+import hashlib
+import numpy as np
+
+MAX_BYTES = 4 * 1024 ** 3
+
+# ---------------------------------------------------------------------------- #
+
+def cache_dir(name = ""):
+  """ Returns (and creates) a cache directory. The root is $GMXTOOLS_CACHE,
+      or ~/.cache/gmxTools if that isn't set.
+  """
+  root = os.environ.get("GMXTOOLS_CACHE",
+                        os.path.join(os.path.expanduser("~"), ".cache", "gmxTools"))
+  path = os.path.join(root, name)
+  os.makedirs(path, exist_ok = True)
+  return path
+
+
+def content_hash(path, chunk = 1 << 20):
+  """ blake2b hex digest of a file's contents, read in chunks. """
+  h = hashlib.blake2b(digest_size = 16)
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(chunk), b""):
+      h.update(block)
+  return h.hexdigest()
+
+
+def file_key(*paths, extra = ""):
+  """ Cache key for one or more source files, built from each file's size,
+      mtime and content hash. extra is mixed in for non-file inputs.
+  """
+  h = hashlib.blake2b(digest_size = 16)
+  for path in paths:
+    st = os.stat(path)
+    h.update("{}:{}:{};".format(st.st_size, st.st_mtime_ns, content_hash(path)).encode())
+  h.update(str(extra).encode())
+  return h.hexdigest()
+
+# ---------------------------------------------------------------------------- #
+
+def touch(*paths):
+  """ Marks cache entries as recently used. """
+  for path in paths:
+    if os.path.exists(path):
+      os.utime(path, None)
+
+
+def evict(directory, max_bytes = MAX_BYTES):
+  """ Removes the least recently used entries of a cache directory until its
+      total size is below max_bytes. Files sharing a stem (e.g. key.npy and
+      key.json) are treated as one entry.
+  """
+
+  entries = {}
+  for name in os.listdir(directory):
+    path = os.path.join(directory, name)
+    if not os.path.isfile(path):
+      continue
+    st   = os.stat(path)
+    stem = name.split(".")[0]
+    size, mtime, files = entries.get(stem, (0, 0, []))
+    entries[stem] = (size + st.st_size, max(mtime, st.st_mtime), files + [path])
+
+  total = sum(e[0] for e in entries.values())
+  for stem, (size, mtime, files) in sorted(entries.items(), key = lambda x: x[1][1]):
+    if total <= max_bytes:
+      break
+    for path in files:
+      try:
+        os.remove(path)
+      except FileNotFoundError:
+        pass # another process got there first
+    total -= size
+
+  return total
+
+# ---------------------------------------------------------------------------- #
+
+def frame_index(path, scan, fields, start = 0, persist = True):
+  """ Byte-offset index of the frames of a trajectory-like file, as a
+      structured array of fields (which include "offset" and "end").
+      scan(offset, max_frames = None) yields the entries of the complete
+      frames from offset on. With persist, the index is kept next to the
+      file as path + ".idx.npy": a saved index is reused if its last entry
+      still reads back the same, and extended if the file has grown;
+      otherwise (e.g. the file was rewritten in place) it is rebuilt by
+      scanning the file from start.
+  """
+
+  index_path = path + ".idx.npy"
+  index      = np.empty(0, dtype = fields)
+
+  if persist and os.path.isfile(index_path):
+    saved = np.load(index_path, allow_pickle = False)
+    if len(saved) and saved.dtype == index.dtype and saved[-1]["end"] <= os.path.getsize(path):
+      try:
+        check = list(scan(int(saved[-1]["offset"]), max_frames = 1))
+      except (ValueError, IndexError, EOFError):
+        check = [] # the file was rewritten since; the saved offsets mean nothing
+      if check and tuple(np.array(check, dtype = fields)[0]) == tuple(saved[-1]):
+        index = saved
+
+  offset = int(index[-1]["end"]) if len(index) else start
+  new    = list(scan(offset))
+  index  = np.concatenate([index, np.array(new, dtype = fields)])
+
+  if persist and (new or not os.path.isfile(index_path)):
+    try:
+      np.save(index_path + ".tmp.npy", index)
+      os.replace(index_path + ".tmp.npy", index_path)
+    except OSError:
+      pass # read-only directory; the index just isn't kept
+
+  return index
@@ -2,14 +2,25 @@
 #  https://gmxapi.readthedocs.io/en/latest/index.html moving forward.
 
 import subprocess
+import re
 import os
+import json
+import hashlib
 import stat
 import shutil
-from fileParser import File
+import tempfile
+import functools
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from .objects import mdp as Mdp
+from .objects.gro import gro as Gro, read_frames as read_gro_frames
+from .objects.edr import edr as Edr
+from . import cache as Cache
+from . import mdlog as Mdlog
 
 # ---------------------------------------------------------------------------- #
 
+@functools.lru_cache(maxsize = None)
 def _base_cmd():
   if os.path.isfile("/share/software/user/open/gromacs/2018/bin/gmx"):
     return "/share/software/user/open/gromacs/2018/bin/gmx"
@@ -19,12 +30,37 @@ def _base_cmd():
     raise ValueError("Couldn't find an executable.")
 
 def _tempfile():
-  return "__temp.txt"
+  """ A fresh capture file per call, so concurrent runs don't clobber each other. """
+  fd, path = tempfile.mkstemp(prefix = "__temp", suffix = ".txt")
+  os.close(fd)
+  return path
 
+@functools.lru_cache(maxsize = None)
 def _gromacs_commands():
-  """ very incomplete list """
-  #TODO: use attributeDict-like language to let gmx.{$command} call gmx.cmd("$command")
-  return ["trjcat", "traj"]
+  """ The tools of the gmx executable, from gmx help commands. Probed once
+      per process; falls back to a few common tools if gmx can't be run.
+  """
+  try:
+    out = subprocess.run([_base_cmd(), "help", "commands"], capture_output = True,
+                         text = True, timeout = 60).stdout
+  except (ValueError, OSError, subprocess.TimeoutExpired):
+    return ["trjcat", "trjconv", "traj", "energy", "make_ndx", "editconf", "solvate"]
+  return re.findall(r"^  ([a-z][\w-]*)\s{2,}", out, re.M)
+
+
+def __getattr__(name):
+  """ gmx.<tool>(**flags) runs cmd("<tool>", **flags) for any gmx tool
+      without a wrapper of its own, e.g. gmx.trjconv(f = ..., o = ...).
+  """
+  if name.startswith("_") or name not in _gromacs_commands():
+    raise AttributeError("module {} has no attribute {}".format(__name__, name))
+
+  def tool(**kwargs):
+    return cmd(name, **kwargs)
+  tool.__name__ = name
+  tool.__doc__  = "Runs gmx {} with the given flags (see cmd).".format(name)
+  globals()[name] = tool
+  return tool
 
 class GROMACSInputError(ValueError):
   """ Error found in user input. """
@@ -55,6 +91,7 @@ class GROMACSFatalError(ValueError):
 
 def check_for_error(stderr):
   """ Does a rudimentary check for errors in a GROMACS stderr file. """
+  from fileParser import File
 
   with File(stderr) as f:
     command = f.advance_to("Command line:", extra = 1)
@@ -71,38 +108,185 @@ def check_for_error(stderr):
   
 
 def check_successful(log):
-  """ Checks for the "Finished mdrun on node" line at the end of a logfile. """
+  """ Checks for the "Finished mdrun on node" line at the end of a logfile.
+      Only the last few KB are read, since that's where mdrun writes it.
+  """
 
   if not os.path.isfile(log):
     return False
 
-  with File(log) as f:
-    if log.endswith(".tpr"):  
-      pass # grompp file - check for existence
-    else: 
-      # assume it's an mdrun log file
-      f.advance_to("Finished mdrun on", quiet = True)
+  if log.endswith(".tpr"):
+    return True # grompp file - check for existence
 
-  if f.eof:
-    return False
-  else:
-    return True
+  # assume it's an mdrun log file. Runs stopped by -maxh or a signal also
+  #  print the "Finished" line, but only after the last checkpoint.
+  tail = _last_part(_tail(log))
+  return "Finished mdrun on" in tail and not _stopped_early(tail)
+
+
+def _tail(path, nbytes = 1 << 16):
+  """ Last nbytes of a file, decoded. """
+  with open(path, 'rb') as f:
+    f.seek(0, os.SEEK_END)
+    f.seek(max(f.tell() - nbytes, 0))
+    return f.read().decode(errors = "replace")
+
+
+def _last_part(text):
+  """ The log text written by the latest (appending) mdrun invocation. """
+  start = text.rfind("Started mdrun")
+  return text[start:] if start >= 0 else text
+
+
+def _stopped_early(text):
+  """ Whether mdrun stopped at a checkpoint before nsteps: wall time (-maxh)
+      ran out or it received a TERM/INT/USR signal.
+  """
+  return "Run time exceeded" in text or "Received the" in text
+
+
+def run_status(tpr):
+  """ State of the run belonging to a tpr file (deffnm convention):
+      "finished", "failed", "checkpointed", "started" or "not started".
+  """
+
+  base = os.path.splitext(tpr)[0]
+  log  = base + ".log"
+  if not os.path.isfile(log):
+    return "not started"
+
+  tail = _last_part(_tail(log))
+  if "Finished mdrun on" in tail and not _stopped_early(tail):
+    return "finished"
+  if "Fatal error" in tail or "Error in user input" in tail:
+    return "failed"
+  if os.path.isfile(base + ".cpt"):
+    return "checkpointed"
+  return "started"
+
+
+def campaign_status(root, index = ".gmx_status.json"):
+  """ Status of every run (tpr file) below root, as {tpr: state}.
+      States are cached in a json index at root, keyed on the size and mtime
+      of each run's log and checkpoint, so only runs that changed are re-read.
+  """
+
+  def key(tpr):
+    base = os.path.splitext(tpr)[0]
+    return [_stat_key(base + ".log"), _stat_key(base + ".cpt")]
+
+  return _campaign_walk(root, index, key, run_status)
+
+
+def campaign_performance(root, index = ".gmx_performance.json", baseline = None):
+  """ Performance records (see mdlog.parse_log) of every run below root, as
+      {tpr: record}, cached in a json index at root like campaign_status.
+      Each record also gets the issues mdlog.diagnose finds and, if baseline
+      (a previous result of this function) has the run, its relative ns/day
+      change and whether that is a regression.
+  """
+
+  log    = lambda tpr: os.path.splitext(tpr)[0] + ".log"
+  parsed = _campaign_walk(root, index, lambda tpr: _stat_key(log(tpr)),
+                          lambda tpr: Mdlog.parse_log(log(tpr)))
+
+  records = {}
+  for tpr, record in parsed.items():
+    if record is None:
+      continue
+    record = dict(record)
+    record["issues"] = Mdlog.diagnose(record)
+    if baseline and tpr in baseline:
+      record["change"], record["regression"] = Mdlog.compare(record, baseline[tpr])
+    records[tpr] = record
+
+  return records
+
+
+def _campaign_walk(root, index, key, compute):
+  """ {tpr: compute(tpr)} for every run (tpr file) below root. Results are
+      cached in the json index file at root together with key(tpr), and only
+      recomputed when that changes; runs whose key is None are left out.
+  """
+
+  index_path = os.path.join(root, index)
+  try:
+    with open(index_path) as f:
+      cached = json.load(f)
+  except (FileNotFoundError, ValueError):
+    cached = {}
+
+  results, updated = {}, {}
+  for parent, dirs, files in os.walk(root):
+    for name in files:
+      if not name.endswith(".tpr"):
+        continue
+      tpr = os.path.join(parent, name)
+      k   = key(tpr)
+      if k is None:
+        continue
+
+      entry = cached.get(tpr)
+      if entry and entry.get("key") == k and "value" in entry:
+        value = entry["value"]
+      else:
+        value = compute(tpr)
+
+      results[tpr] = value
+      updated[tpr] = {"key": k, "value": value}
+
+  if updated != cached:
+    with open(index_path + ".tmp", 'w') as f:
+      json.dump(updated, f)
+    os.replace(index_path + ".tmp", index_path)
+
+  return results
+
+
+def _stat_key(path):
+  try:
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+  except FileNotFoundError:
+    return None
 
 
 def find_checkpoint(tpr):
-  """ Checks for a checkpoint file matching the input tpr file.
-      Does this count as an intelligent restart? 
+  """ The checkpoint to restart the run of tpr from (deffnm convention), see
+      latest_checkpoint. None if there is no intact one.
   """
   assert tpr.endswith(".tpr")
-  print(tpr)
-  cpi = tpr[:-3] + "cpt"
-  print(cpi)
+  return latest_checkpoint(tpr[:-4])
 
-  if os.path.isfile(cpi):
-    return cpi
-  else:
-    return None
-  
+
+CPT_MAGIC1 = 171817
+CPT_MAGIC2 = 171819
+
+def valid_checkpoint(cpt):
+  """ Whether a checkpoint file is complete: it opens with the checkpoint
+      magic number and ends with the footer magic number mdrun writes last.
+  """
+  try:
+    with open(cpt, 'rb') as f:
+      head = f.read(4)
+      f.seek(-4, os.SEEK_END)
+      foot = f.read(4)
+  except (FileNotFoundError, OSError):
+    return False
+  return (int.from_bytes(head, "big", signed = True) == CPT_MAGIC1 and
+          int.from_bytes(foot, "big", signed = True) == CPT_MAGIC2)
+
+
+def latest_checkpoint(deffnm):
+  """ The newest intact checkpoint of a run: deffnm.cpt, or deffnm_prev.cpt
+      if the former is missing or truncated. None if neither can be used.
+  """
+  for cpt in ["{}.cpt".format(deffnm), "{}_prev.cpt".format(deffnm)]:
+    if valid_checkpoint(cpt):
+      return cpt
+    if os.path.isfile(cpt):
+      print("Checkpoint {} is incomplete; not restarting from it.".format(cpt))
+  return None
 
 # ---------------------------------------------------------------------------- #
 
@@ -120,19 +304,21 @@ def _run(cmd, args, **kwargs):
     kwargs["out"] = log
     kwargs["err"] = log
 
+  temp = _tempfile()
+
   if out:
     if os.path.dirname(out):
       os.makedirs(os.path.dirname(out), exist_ok = True)
     f_out = open(out, 'w+')
   else:
-    f_out = open(_tempfile(), 'w+')
+    f_out = open(temp, 'w+')
       
   if err:
     if os.path.dirname(err):
       os.makedirs(os.path.dirname(err), exist_ok = True)
     f_err = open(err, 'w+')
   else:
-    f_err = open(_tempfile(), 'w+')
+    f_err = open(temp, 'w+')
 
   if pipe:
     ps = subprocess.Popen(pipe.split(), stdout = subprocess.PIPE)
@@ -144,19 +330,141 @@ def _run(cmd, args, **kwargs):
   f_out.close()
   f_err.close()
 
-  check_for_error(err if err else _tempfile())
+  try:
+    check_for_error(err if err else temp)
+  finally:
+    if os.path.isfile(temp):
+      os.remove(temp)
+
+  then = kwargs.get("then", None) # called once the command has finished
+  if then:
+    then()
 
-  if os.path.isfile(_tempfile()):
-    os.remove(_tempfile())
-  
   return output
 
 # ---------------------------------------------------------------------------- #
 
+async def arun(cmd, args, on_event = None, **kwargs):
+  """ asyncio counterpart of _run. Each call captures to its own files, and
+      stderr is scanned as it streams: a "Fatal error" or "Error in user
+      input" block raises as soon as it is complete, killing the process.
+      on_event(kind, line) is called for every stderr line, with kind
+      "progress" for mdrun's step/remaining-time lines and "stderr" otherwise.
+      Cancelling the awaiting task kills the process. Run many at once with
+      asyncio.gather.
+  """
+  import asyncio
+
+  cmd  = cmd.format(*args).split()
+  out  = kwargs.get("out", None)
+  err  = kwargs.get("err", None)
+  pipe = kwargs.get("pipe", None)
+  log  = kwargs.get("log", None)
+
+  if log and not (out or err):
+    out, err = log, log
+
+  temps = []
+  for path in [out, err]:
+    if path and os.path.dirname(path):
+      os.makedirs(os.path.dirname(path), exist_ok = True)
+  if not out:
+    out = _tempfile()
+    temps.append(out)
+  if not err:
+    err = out if out in temps else _tempfile()
+    temps.append(err)
+
+  stdin = None
+  if pipe:
+    ps = await asyncio.create_subprocess_exec(*pipe.split(), stdout = subprocess.PIPE)
+    stdin, _ = await ps.communicate()
+
+  f_out = open(out, 'w+')
+  f_err = f_out if out == err else open(err, 'w+')
+
+  proc = await asyncio.create_subprocess_exec(*cmd, stdout = f_out, stderr = subprocess.PIPE,
+            stdin = subprocess.PIPE if stdin is not None else subprocess.DEVNULL)
+  try:
+    if stdin is not None:
+      proc.stdin.write(stdin)
+      await proc.stdin.drain()
+      proc.stdin.close()
+
+    scan = _StderrScan(err)
+    buf  = ""
+    while True:
+      chunk = await proc.stderr.read(1 << 16)
+      if not chunk:
+        break
+      text = chunk.decode(errors = "replace")
+      f_err.write(text)
+      f_err.flush()
+
+      # mdrun rewrites its progress line with carriage returns
+      lines = re.split(r"[\r\n]", buf + text)
+      buf   = lines.pop()
+      for line in lines:
+        scan.feed(line, on_event)
+
+    if buf:
+      scan.feed(buf, on_event)
+    scan.feed("", on_event)
+    return await proc.wait()
+
+  except BaseException:
+    if proc.returncode is None:
+      proc.kill()
+      await proc.wait()
+    raise
+
+  finally:
+    f_out.close()
+    if f_err is not f_out:
+      f_err.close()
+    for path in set(temps):
+      if os.path.isfile(path):
+        os.remove(path)
+
+
+class _StderrScan(object):
+  """ Incremental version of check_for_error, fed one stderr line at a time. """
+
+  errors = {"Error in user input:": GROMACSInputError, "Fatal error:": GROMACSFatalError}
+
+  def __init__(self, path):
+    self.path    = path
+    self.command = None
+    self.next_is_command = False
+    self.error   = None # (exception class, lines so far)
+
+  def feed(self, line, on_event = None):
+    if on_event and line:
+      kind = "progress" if line.startswith("step ") or "will finish" in line else "stderr"
+      on_event(kind, line)
+
+    if self.next_is_command:
+      self.command, self.next_is_command = line, False
+    elif line.startswith("Command line:"):
+      self.next_is_command = True
+
+    if self.error:
+      if line.strip():
+        self.error[1].append(line + "\n")
+      else:
+        exc, text = self.error
+        raise exc(self.path, self.command, "".join(text))
+    else:
+      for marker, exc in self.errors.items():
+        if marker in line:
+          self.error = (exc, [])
+
+# ---------------------------------------------------------------------------- #
+
 def _add_flags(cmd, args, **kwargs):
 
   for key, val in kwargs.items():
-    if val is not None and key not in ["out", "err", "pipe", "log"]:
+    if val is not None and key not in ["out", "err", "pipe", "log", "runner"]:
       # Being nice about accepting boolean arguments
       if val is False or val == "no":
         cmd += " -{} no".format(key)
@@ -205,9 +513,14 @@ def grompp(f = None, c = None, p = None, o = "topol.tpr", po = "mdout.mdp",
   kwargs["o"]  = o
   kwargs["po"] = po
 
-  # Decide first whether to run the file or not.
+  # Decide first whether to run the file or not. With cache, a tpr built
+  #  from identical inputs is reused (or rebuilt if the inputs changed),
+  #  regardless of whether o already exists.
   overwrite = kwargs.pop("overwrite", False)
-  success = check_successful(o)
+  runner    = kwargs.pop("runner", _run)
+  use_cache = kwargs.pop("cache", False)
+  max_bytes = kwargs.pop("max_bytes", Cache.MAX_BYTES)
+  success   = check_successful(o) and not use_cache
 
   # file I/O options
   fio_flags = ["r", "rb", "n", "pp", "t", "e", "imd", "ref"]
@@ -250,9 +563,24 @@ def grompp(f = None, c = None, p = None, o = "topol.tpr", po = "mdout.mdp",
     cmd += " -renum no"
 
 
-  # (possibly) run the preprocessing.
-  if not success or overwrite:
-    _run(cmd, args, **kwargs) # run it!
+  if use_cache:
+    cdir   = use_cache if type(use_cache) is str else Cache.cache_dir("tpr")
+    key    = _grompp_key(executable, **{k: v for k, v in kwargs.items() if k != "executable"})
+    cached = [os.path.join(cdir, key + ext) for ext in [".tpr", ".mdp"]]
+
+  # (possibly) run the preprocessing. Cached files are copied rather than
+  #  linked both ways, so the user's outputs and the cache never share data.
+  if use_cache and not overwrite and all(os.path.isfile(i) for i in cached):
+    st = "Cached {} found for {}. Copying it in place of preprocessing."
+    print(st.format("preprocessing output", o))
+    for src, dst in zip(cached, [o, po]):
+      _materialize(src, dst, link = False)
+    Cache.touch(*cached)
+  elif not success or overwrite:
+    store = None
+    if use_cache:
+      store = functools.partial(_grompp_store, [o, po], cached, _stat_key(o), max_bytes)
+    runner(cmd, args, then = store, **kwargs) # run it!
   elif success and not overwrite:
     st = "Successful {} found at {}. Skipping simulation and forwarding outputs."
     print(st.format("preprocessing output", o))
@@ -266,6 +594,103 @@ def grompp(f = None, c = None, p = None, o = "topol.tpr", po = "mdout.mdp",
 
 # ---------------------------------------------------------------------------- #
 
+def _grompp_key(executable, **kwargs):
+  """ Content hash of everything that determines a grompp output: the mdp
+      parameters, the topology and every file it #includes, the coordinate,
+      restraint and index files, the other options and the executable.
+  """
+
+  parts = []
+
+  params = Mdp(kwargs["f"])
+  parts.append(sorted((k, v) for k, v in params.items() if k not in ["path", "name"]))
+
+  parts.append([(inc, Cache.content_hash(inc) if os.path.isfile(inc) else None)
+                for inc in _top_includes(kwargs["p"], executable)])
+
+  for flag in ["c", "r", "rb", "n", "t", "e", "ref"]:
+    if kwargs.get(flag):
+      parts.append((flag, Cache.content_hash(kwargs[flag])))
+
+  options = ["maxwarn", "time", "zero", "renum", "rmvsbds"]
+  parts.append(sorted((k, str(kwargs[k])) for k in options if kwargs.get(k) is not None))
+
+  # The executable's size and mtime stand in for its version. Commands like
+  #  "python gmx_standin.py" count every word that names a file.
+  for word in executable.split():
+    exe = os.path.realpath(shutil.which(word) or word)
+    if os.path.isfile(exe):
+      st = os.stat(exe)
+      parts.append((exe, st.st_size, st.st_mtime_ns))
+    else:
+      parts.append(word)
+
+  return hashlib.blake2b(repr(parts).encode(), digest_size = 16).hexdigest()
+
+
+def _top_includes(top, executable = None, seen = None):
+  """ The topology and all files it #includes, recursively. Includes are
+      resolved like grompp does: next to the including file, then in the
+      working directory, $GMXLIB, $GMXDATA/top and the executable's
+      share/gromacs/top.
+      Unresolved names are kept as they are so they still count in the key.
+  """
+
+  seen = [] if seen is None else seen
+  if top in seen:
+    return seen
+  seen.append(top)
+  if not os.path.isfile(top):
+    return seen
+
+  search = [os.path.dirname(top), os.getcwd()]
+  search += os.environ.get("GMXLIB", "").split(os.pathsep)
+  if os.environ.get("GMXDATA"):
+    search.append(os.path.join(os.environ["GMXDATA"], "top"))
+  if executable:
+    exe = os.path.realpath(shutil.which(executable) or executable)
+    search.append(os.path.join(os.path.dirname(os.path.dirname(exe)), "share", "gromacs", "top"))
+
+  with open(top) as f:
+    for line in f:
+      if not line.lstrip().startswith("#include"):
+        continue
+      name  = line.split("#include", 1)[1].strip().strip('"<>')
+      found = [os.path.join(d, name) for d in search if d and os.path.isfile(os.path.join(d, name))]
+      _top_includes(os.path.normpath(found[0]) if found else name, executable, seen)
+
+  return seen
+
+
+def _materialize(src, dst, link = True):
+  """ Hardlinks src to dst (replacing dst), copying if link is False or
+      linking isn't possible.
+  """
+  if os.path.dirname(dst):
+    os.makedirs(os.path.dirname(dst), exist_ok = True)
+  tmp = dst + ".tmp"
+  try:
+    if not link:
+      raise OSError
+    os.link(src, tmp)
+  except OSError:
+    shutil.copyfile(src, tmp)
+  os.replace(tmp, dst)
+
+
+def _grompp_store(outputs, cached, before, max_bytes):
+  """ Copies freshly built grompp outputs into the cache, unless the tpr is
+      missing or unchanged since before (the _stat_key taken before the run).
+  """
+  if not os.path.isfile(outputs[0]) or _stat_key(outputs[0]) == before:
+    return
+  for src, dst in zip(outputs, cached):
+    if os.path.isfile(src):
+      _materialize(src, dst, link = False)
+  Cache.evict(os.path.dirname(cached[0]), max_bytes)
+
+# ---------------------------------------------------------------------------- #
+
 def mdrun(s = None, o = "traj.trr", c = "confout.gro", e = "ener.edr", 
           g = "md.log", **kwargs):
   
@@ -290,11 +715,12 @@ def mdrun(s = None, o = "traj.trr", c = "confout.gro", e = "ener.edr",
 
   # Decide first whether to run the file or not.
   overwrite  = kwargs.pop("overwrite", False)
+  runner     = kwargs.pop("runner", _run)
   success    = check_successful(g)
 
   # Check if an incomplete run exists (by looking for checkpoint file)
   if (not "cpi" in kwargs.keys() or kwargs["cpi"] is None) and not success:
-    checkpoint = find_checkpoint(s)
+    checkpoint = latest_checkpoint(os.path.splitext(s)[0])
     if checkpoint:
       st = "Partial checkpoint file found at {}. Restarting simulation from this file."
 #       cmd += " -cpi {}".format(checkpoint)
@@ -306,7 +732,7 @@ def mdrun(s = None, o = "traj.trr", c = "confout.gro", e = "ener.edr",
 
   # (possibly) run the simulation.
   if not success or overwrite:
-    _run(cmd, args, **kwargs) # run it!
+    runner(cmd, args, **kwargs) # run it!
   elif success and not overwrite:
     st = "Successful {} found at {}. Skipping simulation and forwarding outputs."
     print(st.format("simulation output", o))
@@ -323,17 +749,128 @@ def mdrun(s = None, o = "traj.trr", c = "confout.gro", e = "ener.edr",
       kwargs[key] = deffnm + ext
 
   files = _gather_outputs(all_outputs, **kwargs)
+  files.setdefault("g", g)
+  files["performance"] = Mdlog.parse_log(g)
 
   return files
 
 # ---------------------------------------------------------------------------- #
 
+def mdrun_segments(deffnm = None, maxh = None, cpt = 15, segments = None,
+                   executable = None, **kwargs):
+  """ Runs deffnm.tpr as a series of wall-time limited mdrun segments.
+      Each segment gets -maxh maxh (hours) and writes a checkpoint every cpt
+      minutes; it resumes from the latest intact checkpoint with -append, so
+      a run stopped by -maxh or killed by the scheduler continues where its
+      last checkpoint left off. Runs segments segments (None: until the run
+      finishes). Every segment is recorded in deffnm_segments.json.
+      Returns the mdrun outputs plus the segment records under "segments".
+  """
+
+  assert deffnm, "mdrun_segments needs deffnm"
+  import time
+
+  log     = "{}.log".format(deffnm)
+  records = _load_segments(deffnm)
+  files   = None
+  n       = 0
+
+  while segments is None or n < segments:
+    if check_successful(log):
+      if files is None:
+        files = mdrun(s = deffnm + ".tpr", deffnm = deffnm, executable = executable, **kwargs)
+      break
+
+    cpi    = latest_checkpoint(deffnm)
+    record = {"segment": len(records), "cpi": cpi, "maxh": maxh,
+              "start": time.time(), "status": "running"}
+    records.append(record)
+    _save_segments(deffnm, records)
+
+    try:
+      files = mdrun(s = deffnm + ".tpr", deffnm = deffnm, cpi = cpi,
+                    append = True if cpi else None, maxh = maxh, cpt = cpt,
+                    overwrite = True, executable = executable, **kwargs)
+      record["status"]     = _segment_status(log)
+      record["ns_per_day"] = (files["performance"] or {}).get("ns_per_day")
+    except (GROMACSInputError, GROMACSFatalError) as e:
+      record["status"] = "failed"
+      record["error"]  = str(e)
+      raise
+    finally:
+      record["end"]  = time.time()
+      record["wall"] = record["end"] - record["start"]
+      record.update(_segment_progress(deffnm))
+      _save_segments(deffnm, records)
+
+    n += 1
+    if record["status"] == "finished":
+      break
+    previous = records[-2].get("step") if len(records) > 1 else None
+    if record["status"] == "killed" and (not latest_checkpoint(deffnm) or record["step"] == previous):
+      raise ValueError("mdrun segment {} of {} stopped without making progress."
+                       .format(record["segment"], deffnm))
+
+  files = files if files is not None else {}
+  files["segments"] = records
+  return files
+
+
+def _segment_status(log):
+  """ How the latest mdrun invocation writing to log ended. """
+  if not os.path.isfile(log):
+    return "killed"
+  text = _last_part(_tail(log))
+  if _stopped_early(text):
+    return "stopped"
+  if "Finished mdrun on" in text:
+    return "finished"
+  return "killed"
+
+
+def _segment_progress(deffnm):
+  """ Step and time reached so far, from the last frame of the edr file. """
+  try:
+    energies = Edr("{}.edr".format(deffnm), index = False)
+  except (AssertionError, ValueError):
+    return {"step": None, "time": None}
+  if not len(energies):
+    return {"step": None, "time": None}
+  return {"step": int(energies.step[-1]), "time": float(energies.time[-1])}
+
+
+def _load_segments(deffnm):
+  """ Segment records of earlier calls. A record still marked running
+      belongs to a process that died mid-segment.
+  """
+  try:
+    with open("{}_segments.json".format(deffnm)) as f:
+      records = json.load(f)
+  except (FileNotFoundError, ValueError):
+    return []
+  for record in records:
+    if record["status"] == "running":
+      record["status"] = "interrupted"
+  return records
+
+
+def _save_segments(deffnm, records):
+  path = "{}_segments.json".format(deffnm)
+  with open(path + ".tmp", 'w') as f:
+    json.dump(records, f, indent = 1)
+  os.replace(path + ".tmp", path)
+
+# ---------------------------------------------------------------------------- #
+
 def simulate(name = None, mdp = None, top = None, conf = None, maxwarn = 0, nt = 1,
              ndx = None, po = None, tableb = None, overwrite = False, parent = None,
              cpi = None, restr = None, executable = None, dds = None, pforce=None,
-             nb = None):
+             nb = None, pin = None, pinoffset = None, pinstride = None, cache = False,
+             maxh = None, cpt = 15, segments = None):
 
-  """ Light wrapper around grompp and mdrun. """
+  """ Light wrapper around grompp and mdrun. With maxh, mdrun runs in
+      wall-time limited segments (see mdrun_segments).
+  """
 
   assert name and mdp and top and conf
   path = os.path.join(parent, name) if parent else name
@@ -348,20 +885,106 @@ def simulate(name = None, mdp = None, top = None, conf = None, maxwarn = 0, nt =
 
   pre = grompp(f = mdp, c = conf, p = top, o = tpr, maxwarn = maxwarn, 
                log = pplog, n = ndx, po = po, overwrite = overwrite, 
-               executable = executable, r = restr)
+               executable = executable, r = restr, cache = cache)
+
+  if maxh:
+    sim = mdrun_segments(deffnm = path, maxh = maxh, cpt = cpt, segments = segments,
+                         log = log, nt = nt, tableb = tableb, executable = executable,
+                         dds = dds, pforce = pforce, nb = nb, pin = pin,
+                         pinoffset = pinoffset, pinstride = pinstride)
+    return pre, sim
 
   sim = mdrun(s = tpr, deffnm = path, log = log, nt = nt, tableb = tableb, 
               overwrite = overwrite, cpi = cpi, executable = executable, dds = dds,
-              pforce=pforce, nb=nb)
+              pforce=pforce, nb=nb, pin = pin, pinoffset = pinoffset, pinstride = pinstride)
 
   return pre, sim
 
 # ---------------------------------------------------------------------------- #
 
-def sp(name = None, mdp = None, top = None, conf = None, maxwarn = 0, nt = 1, **kwargs):
+def simulate_many(specs, cores = None, pin = True):
+  """ Runs many simulate() calls concurrently on one node.
+      Each spec is a dict of simulate kwargs. Jobs are packed onto the cores
+      according to their nt (default 1; 0 or None takes the whole node) and,
+      if pin, pinned to disjoint core ranges with -pin on -pinoffset.
+      Returns a list of (pre, sim) tuples in the order of specs; a job that
+      raised, or whose spec is invalid, holds its exception instead, so one
+      failure doesn't stop the batch.
+  """
+
+  cores   = cores if cores else os.cpu_count()
+  free    = [True] * cores
+  results = [None] * len(specs)
+  queue   = list(range(len(specs)))
+  running = {}
+
+  with ThreadPoolExecutor(max_workers = cores) as pool:
+    while queue or running:
+
+      # Start every queued job that fits in a free block of cores (backfilling)
+      for i in list(queue):
+        try:
+          nt = _job_threads(specs[i], cores)
+        except ValueError as e:
+          results[i] = e
+          queue.remove(i)
+          continue
+
+        offset = _find_free_block(free, nt)
+        if offset is None:
+          continue
+
+        free[offset:offset + nt] = [False] * nt
+        kwargs = dict(specs[i], nt = nt)
+        if pin:
+          kwargs.update(pin = "on", pinoffset = offset, pinstride = 1)
+        running[pool.submit(simulate, **kwargs)] = (i, offset, nt)
+        queue.remove(i)
+
+      # Wait for a job to finish and release its cores
+      done, _ = wait(running, return_when = FIRST_COMPLETED)
+      for fut in done:
+        i, offset, nt = running.pop(fut)
+        free[offset:offset + nt] = [True] * nt
+        try:
+          results[i] = fut.result()
+        except Exception as e:
+          results[i] = e
+
+  return results
+
+
+def _job_threads(spec, cores):
+  """ Cores a simulate_many spec needs: its nt (default 1), with 0 or None
+      (let mdrun decide) taking the whole node.
+  """
+  nt = spec.get("nt", 1)
+  if nt is None or nt == 0:
+    return cores
+  if type(nt) is not int or nt < 0:
+    raise ValueError("nt must be a positive int, 0 or None, not {!r}.".format(nt))
+  if nt > cores:
+    raise ValueError("Job asks for {} cores; only {} available.".format(nt, cores))
+  return nt
+
+
+def _find_free_block(free, n):
+  """ Offset of the first run of n free cores, or None. """
+  run = 0
+  for i, f in enumerate(free):
+    run = run + 1 if f else 0
+    if run == n:
+      return i - n + 1
+  return None
+
+# ---------------------------------------------------------------------------- #
+
+def sp(name = None, mdp = None, top = None, conf = None, maxwarn = 0, nt = 1,
+       term = "Potential", **kwargs):
   """ Calculates the single point energy of a given configuration. 
       Light wrapper around simulate and cmd. 
-      Uses gmx rerun to calculate the sp energy and extracts it from an xvg file.
+      Uses gmx rerun to calculate the sp energy and reads it from the edr file.
+      term is an energy term name, or its 1-based number in the gmx energy menu.
   """
 
   assert name and mdp and top and conf
@@ -375,62 +998,172 @@ def sp(name = None, mdp = None, top = None, conf = None, maxwarn = 0, nt = 1, **
   pplog = "{}_pp.txt".format(name)
   log   = "{}.txt".format(name)
   tpr   = "{}.tpr".format(name)
-  xvg   = "{}.xvg".format(name)
-  elog  = "{}_energy.txt".format(name)
 
   pre = grompp(f = mdp, c = conf, p = top, o = tpr, maxwarn = maxwarn, log = pplog)
   sim = mdrun(s = tpr, deffnm = name, rerun = conf, log = log, executable = executable, nt = nt)
-  res = cmd("energy", f = sim["e"], o = xvg, pipe = 'echo 9', log = elog)
 
   # Gather results
-  with File(xvg) as f:
-    f.advance_to("    0.000000 ")
-    energy = float(f.cl.split()[-1])
+  energies = Edr(sim["e"], index = False)
+  term     = term - 1 if type(term) is int else term
+  return float(energies.get(term)[0])
+
+# ---------------------------------------------------------------------------- #
+
+def sp_many(name = None, mdp = None, top = None, confs = None, template = None,
+            terms = "Potential", maxwarn = 0, nt = 1, **kwargs):
+  """ Single point energies of many configurations with one grompp and one
+      rerun; the energies are read from the rerun's edr file directly.
+      confs is a list of gro files or of (n_atoms, 3) coordinate arrays in nm;
+      arrays take their atom names and box from the template gro file.
+      terms names the energy term(s) to return, read straight from the edr
+      file. Returns an (n_confs,) array, or (n_confs, n_terms) if several
+      terms are requested; raises ValueError if some configuration got no
+      energy frame.
+  """
+
+  assert name and mdp and top and confs is not None and len(confs)
+
+  executable = kwargs.get("executable")
+  executable = executable if executable else _base_cmd()
+
+  if type(mdp) is Mdp:
+    mdp = mdp.write("{}.mdp".format(name))
+
+  pplog = "{}_pp.txt".format(name)
+  log   = "{}.txt".format(name)
+  tpr   = "{}.tpr".format(name)
+  traj  = "{}_frames.gro".format(name)
+
+  # Stack the configurations into one multi-frame trajectory
+  if all(type(c) is str for c in confs):
+    gro_trajectory(confs, traj)
+    conf = confs[0]
+  else:
+    assert template, "coordinate arrays need a template gro file"
+    gro_frames(template, confs, traj)
+    conf = template
+
+  if type(terms) is str:
+    terms = [terms]
+
+  pre = grompp(f = mdp, c = conf, p = top, o = tpr, maxwarn = maxwarn, log = pplog,
+               executable = executable)
+  sim = mdrun(s = tpr, deffnm = name, rerun = traj, log = log, executable = executable, nt = nt)
+
+  # Gather results: one row per configuration. A rerun of gro frames numbers
+  # its steps by frame, so the step says which configuration a frame holds.
+  edr    = Edr(sim["e"], index = False)
+  values = edr.get(*terms)
+  steps  = edr.step
+  if len(np.unique(steps)) == len(steps) and np.all((steps >= 0) & (steps < len(confs))):
+    out = np.full((len(confs),) + values.shape[1:], np.nan)
+    out[steps] = values
+    missing = np.setdiff1d(np.arange(len(confs)), steps)
+  elif len(edr) == len(confs):
+    out, missing = values, []
+  else:
+    raise ValueError("{} holds {} energy frames for {} configurations.".format(sim["e"], len(edr), len(confs)))
 
-  return energy
+  if len(missing):
+    raise ValueError("{} has no energy frame for configurations {}.".format(sim["e"], missing.tolist()))
+  return out
 
 # ---------------------------------------------------------------------------- #
 
-def normal_modes(name = None, mdp = None, top = None, conf = None, maxwarn = 0, nt = 1):
-  """ Energy minimization. Will 
-      Light wrapper around simulate and cmd. 
-      Uses gmx rerun to calculate the sp energy and extracts it from an xvg file.
+def normal_modes(name = None, mdp = None, top = None, conf = None, maxwarn = 0, nt = 1,
+                 em_mdp = None, n_modes = 20, masses = None, sigma = -1.0, **kwargs):
+  """ Normal mode analysis. Optionally minimizes conf with em_mdp first, then
+      runs the nm integrator (mdp is forced to integrator = nm; use a double
+      precision executable) to write the Hessian, reads it as a scipy sparse
+      matrix and solves for the lowest n_modes of the mass-weighted Hessian
+      with shift-invert Lanczos (eigsh) around sigma.
+      masses default to the atom masses in top. Returns the frequencies in
+      cm^-1 (negative for imaginary modes) and the mass-weighted eigenvectors
+      as an (n_modes, n_atoms, 3) array.
   """
 
   assert name and mdp and top and conf
 
+  from scipy.sparse import diags
+  from scipy.sparse.linalg import eigsh
+
+  executable = kwargs.get("executable")
+  executable = executable if executable else _base_cmd()
+
+  # Minimize first, so the Hessian is taken at a stationary point.
+  if em_mdp:
+    em_pre, em_sim = simulate(name = "{}_em".format(name), mdp = em_mdp, top = top,
+                              conf = conf, maxwarn = maxwarn, nt = nt, executable = executable)
+    conf = em_sim["c"]
+
+  # Work on a copy (read back from disk), so the caller's Mdp keeps its integrator
   if type(mdp) is Mdp:
     mdp = mdp.write("{}.mdp".format(name))
+  nm_mdp = Mdp(mdp)
+  nm_mdp.integrator = "nm"
+  mdp = nm_mdp.write("{}.mdp".format(name))
 
   pplog = "{}_pp.txt".format(name)
   log   = "{}.txt".format(name)
   tpr   = "{}.tpr".format(name)
-  xvg   = "{}.xvg".format(name)
-  elog  = "{}_energy.txt".format(name)
+  mtx   = "{}.mtx".format(name)
 
-  pre = grompp(f = mdp, c = conf, p = top, o = tpr, maxwarn = maxwarn, log = pplog)
-  sim = mdrun(s = tpr, deffnm = name, rerun = conf, log = log, nt = nt)
-  res = cmd("energy", f = sim["e"], o = xvg, pipe = 'echo 9', log = elog)
+  pre = grompp(f = mdp, c = conf, p = top, o = tpr, maxwarn = maxwarn, log = pplog,
+               executable = executable)
+  sim = mdrun(s = tpr, deffnm = name, mtx = mtx, log = log, executable = executable, nt = nt)
 
-  # Gather results
-  with File(xvg) as f:
-    f.advance_to("    0.000000 ")
-    energy = float(f.cl.split()[-1])
+  # Mass-weight the Hessian: M^-1/2 H M^-1/2
+  hessian = load_mtx(mtx)
+  if masses is None:
+    masses = [a.mass for a in load_top(top).atoms]
+  inv_sqrt_m = diags(np.repeat(1 / np.sqrt(np.asarray(masses, dtype = np.float64)), 3))
+  hessian    = inv_sqrt_m @ hessian @ inv_sqrt_m
+
+  # Eigenvalues are in kJ mol^-1 nm^-2 amu^-1 = ps^-2.
+  vals, vecs = eigsh(hessian, k = min(n_modes, hessian.shape[0] - 1), sigma = sigma, which = "LM")
+  order      = np.argsort(vals)
+  vals, vecs = vals[order], vecs[:, order]
+  freqs      = np.sign(vals) * np.sqrt(np.abs(vals)) / (2 * np.pi * 2.99792458e-2)
 
-  return energy
+  return freqs, vecs.T.reshape(len(vals), -1, 3)
 
 # ---------------------------------------------------------------------------- #
 
 def cmd(name, **kwargs):
 
   # Light wrapper around subprocess.run. out and err kwargs are stdout and stderr.
-  cmd  = _base_cmd() + " {}".format(name)
-  args = []
+  runner = kwargs.pop("runner", _run)
+  cmd    = _base_cmd() + " {}".format(name)
+  args   = []
 
   cmd, args = _add_flags(cmd, args, **kwargs)
-  _run(cmd, args, **kwargs)
+  runner(cmd, args, **kwargs)
   return kwargs
 
+# ---------------------------------------------------------------------------- #
+
+async def _deferred(func, on_event, **kwargs):
+  """ Builds a command with func (grompp, mdrun or cmd) but runs it with arun. """
+  calls = []
+  files = func(runner = lambda *args, **kw: calls.append((args, kw)), **kwargs)
+  for (cmd, args), kw in calls:
+    then = kw.pop("then", None)
+    await arun(cmd, args, on_event = on_event, **kw)
+    if then:
+      then()
+  if "performance" in files:
+    files["performance"] = Mdlog.parse_log(files["g"])
+  return files
+
+async def agrompp(on_event = None, **kwargs):
+  return await _deferred(grompp, on_event, **kwargs)
+
+async def amdrun(on_event = None, **kwargs):
+  return await _deferred(mdrun, on_event, **kwargs)
+
+async def acmd(name, on_event = None, **kwargs):
+  return await _deferred(lambda **kw: cmd(name, **kw), on_event, **kwargs)
+
 # ---------------------------------------------------------------------------- #
 # ---------------------------------------------------------------------------- #
 # ---------------------------------------------------------------------------- #
@@ -440,7 +1173,8 @@ def gro_trajectory(gro_list, outfile):
       of gro files into one big gro file. very rudimentary.
   """
       
-  os.makedirs(os.path.dirname(outfile), exist_ok = True)
+  if os.path.dirname(outfile):
+    os.makedirs(os.path.dirname(outfile), exist_ok = True)
   with open(outfile, 'w+') as f:
     for gro in gro_list:
 
@@ -452,18 +1186,136 @@ def gro_trajectory(gro_list, outfile):
 
   return outfile
     
+def gro_frames(template, coords, outfile):
+  """ Writes a multi-frame gro file that reuses the atom names and box of
+      template with each (n_atoms, 3) coordinate array in coords (nm).
+  """
+
+  frame = Gro(template)
+  for i, xyz in enumerate(coords):
+    assert len(xyz) == len(frame.name), "frame {} has {} atoms, not {}".format(i, len(xyz), len(frame.name))
+
+  frame.title = "frames from {}".format(os.path.basename(template))
+  frame.xyz   = np.asarray(coords, dtype = np.float64)
+  frame.time  = np.arange(len(coords), dtype = np.float64)
+  frame.box   = np.repeat(frame.box[None], len(coords), axis = 0)
+  frame.v     = None
+  return frame.write(outfile)
+
 # ---------------------------------------------------------------------------- #
 # ---------------------------------------------------------------------------- #
 
-def load_top(topfile):
+_top_memo = {}
+
+def load_top(topfile, cache = False, max_bytes = Cache.MAX_BYTES, executable = None):
+  """ Parses a topology with parmed. Parsed topologies are memoized in
+      process, keyed on the content of the top file and every file it
+      #includes, and each call gets a fresh copy. cache = True (or a
+      directory) also keeps them as pickles on disk across sessions.
+      Includes are resolved like grompp does, including the force field
+      directory of executable (default: the usual gmx, if there is one).
+  """
+
+  import pickle
+
+  if not executable:
+    try:
+      executable = _base_cmd()
+    except ValueError:
+      executable = None # no gmx here; force field files are found via $GMXLIB/$GMXDATA only
+
+  includes = _top_includes(topfile, executable)
+  key      = Cache.file_key(*[i for i in includes if os.path.isfile(i)],
+                            extra = [i for i in includes if not os.path.isfile(i)])
+
+  if key in _top_memo:
+    return pickle.loads(_top_memo[key])
+
+  path = None
+  if cache:
+    cdir = cache if type(cache) is str else Cache.cache_dir("top")
+    path = os.path.join(cdir, key + ".pkl")
+    if os.path.isfile(path):
+      with open(path, 'rb') as f:
+        _top_memo[key] = f.read()
+      Cache.touch(path)
+      return pickle.loads(_top_memo[key])
+
   import parmed
   top = parmed.gromacs.GromacsTopologyFile(topfile)
+
+  try:
+    _top_memo[key] = pickle.dumps(top, protocol = pickle.HIGHEST_PROTOCOL)
+  except (pickle.PicklingError, TypeError, AttributeError):
+    return top # not picklable; nothing to cache
+
+  if path:
+    with open(path + ".tmp", 'wb') as f:
+      f.write(_top_memo[key])
+    os.replace(path + ".tmp", path)
+    Cache.evict(cdir, max_bytes)
+
   return top
 
 # ---------------------------------------------------------------------------- #
 
-def load_gro(grofile):
+def load_mtx(mtxfile):
+  """ Reads a GROMACS Hessian (.mtx, written by mdrun -mtx) into a scipy
+      sparse csr matrix. Handles full and sparse storage, single and double
+      precision, and expands compressed symmetric (upper triangle) storage.
+  """
+
+  from scipy.sparse import csr_matrix, triu
+
+  with open(mtxfile, 'rb') as f:
+    buf = f.read()
+
+  # XDR header, in gmx_mtxio_write order: magic number, the generating
+  #  version as a gmx_fio string (strlen + 1, then an xdr string: length and
+  #  bytes padded to 4), precision (1 for double), shape and storage type
+  magic = int(np.frombuffer(buf, '>i4', 1, 0)[0]) if len(buf) >= 4 else None
+  if magic != 0x34ce8fd2:
+    raise ValueError("{} is not a GROMACS mtx file.".format(mtxfile))
+  slen = int(np.frombuffer(buf, '>u4', 1, 8)[0])
+  pos  = 12 + slen + (-slen % 4)
+  prec, nrow, ncol, kind = np.frombuffer(buf, '>i4', 4, pos).tolist()
+  pos += 16
+  real = '>f8' if prec == 1 else '>f4'
+
+  if kind == 0:
+    full = np.frombuffer(buf, real, nrow * ncol, pos).astype(np.float64).reshape(nrow, ncol)
+    return csr_matrix(full)
+  if kind != 1:
+    raise ValueError("{} has unknown mtx storage type {}.".format(mtxfile, kind))
+
+  # Sparse: compressed_symmetric, nrow, ndata[nrow], then (col, value) pairs
+  symmetric, srow = np.frombuffer(buf, '>i4', 2, pos).tolist()
+  pos  += 8
+  if srow != nrow:
+    raise ValueError("{} has {} sparse rows for a {}-row matrix.".format(mtxfile, srow, nrow))
+  ndata = np.frombuffer(buf, '>i4', srow, pos).astype(np.int64)
+  pos  += 4 * srow
+  pairs = np.frombuffer(buf, np.dtype([("col", '>i4'), ("val", real)]), int(ndata.sum()), pos)
+
+  indptr = np.concatenate([[0], np.cumsum(ndata)])
+  matrix = csr_matrix((pairs["val"].astype(np.float64), pairs["col"].astype(np.int64), indptr),
+                      shape = (nrow, ncol))
+
+  if symmetric:
+    upper  = triu(matrix, k = 1)
+    matrix = (matrix + upper.T).tocsr()
+
+  return matrix
+
+# ---------------------------------------------------------------------------- #
 
+def load_gro(grofile, parmed = False, frame = 0):
+  """ Loads a structure as an objects.gro (numpy arrays). frame = None stacks
+      every frame of a multi-frame file. parmed = True returns a parmed
+      structure instead, for when full topology objects are needed.
+  """
+
+  tempfile = None
   if not grofile.endswith("gro"):
 
     gro_base = os.path.splitext(grofile)[0]
@@ -482,13 +1334,18 @@ def load_gro(grofile):
       cmd("editconf", f = grofile, o = gro_base + ".gro", out = log, err = log)
       tempfile = gro_base + ".gro"
 
-    import parmed
-    gro = parmed.gromacs.GromacsGroFile.parse(tempfile)
-    os.remove(tempfile)
+  path = tempfile if tempfile else grofile
 
+  if parmed:
+    import parmed as pmd
+    gro = pmd.gromacs.GromacsGroFile.parse(path)
+  elif frame is None:
+    gro = read_gro_frames(path)
   else:
-    import parmed
-    gro = parmed.gromacs.GromacsGroFile.parse(grofile)
+    gro = Gro(path, frame)
+
+  if tempfile:
+    os.remove(tempfile)
 
   return gro
 
@@ -513,6 +1370,7 @@ def load_mdp_list(path):
       else:
         raise ValueError("mdp file at path {} not found.".format(filepath))
 
+  from fileParser import File
   get = lambda x: find_file(os.path.dirname(path), x)
 
   with File(path) as f:
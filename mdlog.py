@@ -0,0 +1,175 @@
+# Performance accounting from mdrun log files: throughput, the real cycle and
+#  time accounting table, PME/PP balance and domain decomposition imbalance,
+#  as plain records that can be compared between runs.
+
+import os
+import re
+from .objects.misc import AttributeDict
+
+# The performance section opens with the flop count; the load balance report
+#  follows it, then the cycle and time accounting
+_FLOPS      = "M E G A - F L O P S   A C C O U N T I N G"
+_ACCOUNTING = "R E A L   C Y C L E   A N D   T I M E   A C C O U N T I N G"
+
+# Activity, then ranks, threads and call count (absent for Rest and Total),
+#  then wall time (s), giga-cycles and percentage
+_ROW = re.compile(r"^\s*(\S.*?)\s+(?:(\d+)\s+(\d+)\s+(\d+)\s+)?(-?[\d.]+)\s+(-?[\d.]+)\s+(-?[\d.]+)\s*$")
+
+_FLOAT = r"([-+]?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)"
+
+_PATTERNS = {
+  "dd_imbalance": r"Average load imbalance:\s*" + _FLOAT,
+  "dd_wait":      r"run time spent waiting due to load imbalance:\s*" + _FLOAT,
+  "pme_load":     r"Average PME mesh/force load:\s*" + _FLOAT,
+  "pme_wait":     r"run time spent waiting due to PP/PME imbalance:\s*" + _FLOAT,
+  "lost":         r"NOTE:\s*" + _FLOAT + r"\s*% of the available CPU time was lost due to load imbalance",
+}
+
+# ---------------------------------------------------------------------------- #
+
+def parse_log(log, segments = False, nbytes = 1 << 18):
+  """ Performance record of an mdrun log file, as an AttributeDict with
+      ns_per_day, hours_per_ns, core_time, wall_time and core_pct (the Time:
+      and Performance: lines), ranks and threads, tasks (one record per row
+      of the cycle accounting table: name, ranks, threads, calls, wall_time,
+      gcycles and pct), the PME mesh breakdown under pme_tasks, the load
+      balance figures dd_imbalance, dd_wait, dd_limited, pme_load, pme_wait
+      and lost (all in %, except pme_load) and the NOTE lines of the
+      performance section. Values a log doesn't report are None.
+      Only the end of the file is read, which holds the last invocation. With
+      segments = True the whole file is read and a list is returned with one
+      record per invocation that appended to it. Returns None (or skips the
+      invocation) if mdrun didn't get as far as writing its accounting.
+  """
+
+  if not os.path.isfile(log):
+    return [] if segments else None
+
+  with open(log, 'rb') as f:
+    if not segments:
+      f.seek(0, os.SEEK_END)
+      f.seek(max(f.tell() - nbytes, 0))
+    text = f.read().decode(errors = "replace")
+
+  if not segments:
+    return _parse_section(text)
+
+  parts = re.split(r"(?=^\s*Started mdrun)", text, flags = re.M)
+  return [_parse_section(p) for p in parts if _ACCOUNTING in p]
+
+
+def _parse_section(text):
+  """ Parses the last performance section in text, or returns None. """
+
+  table = text.rfind(_ACCOUNTING)
+  if table < 0:
+    return None
+  start = text.rfind(_FLOPS, 0, table)
+  text  = text[max(start, 0):]
+  table = text.find(_ACCOUNTING)
+
+  record = AttributeDict()
+  for key in ["ns_per_day", "hours_per_ns", "core_time", "wall_time", "core_pct",
+              "ranks", "threads", "dd_limited"] + list(_PATTERNS):
+    record[key] = None
+  record.tasks     = []
+  record.pme_tasks = []
+  record.notes     = []
+
+  ranks = re.search(r"On (\d+) MPI ranks?(?: doing PP)?(?:, each using (\d+) OpenMP threads?)?", text[table:])
+  if ranks:
+    record.ranks   = int(ranks.group(1))
+    record.threads = int(ranks.group(2)) if ranks.group(2) else 1
+    pme = re.search(r"\bon (\d+) MPI ranks? doing PME", text[table:])
+    if pme:
+      record.ranks += int(pme.group(1))
+
+  # The accounting table, followed by optional breakdown tables of which
+  #  only the PME mesh one is kept; the Time: line ends the section
+  rows = record.tasks
+  for line in text[table:].splitlines():
+    if "Breakdown of" in line or "GPU timings" in line:
+      rows = record.pme_tasks if "PME mesh" in line else None
+      continue
+    match = _ROW.match(line)
+    if not match:
+      continue
+    name, ranks_, threads, calls, wall, gcycles, pct = match.groups()
+    if name.startswith(("Time:", "Performance:")):
+      break
+    if rows is None:
+      continue
+    task = AttributeDict()
+    task.name      = name.strip()
+    task.ranks     = int(ranks_) if ranks_ else None
+    task.threads   = int(threads) if threads else None
+    task.calls     = int(calls) if calls else None
+    task.wall_time = float(wall)
+    task.gcycles   = float(gcycles)
+    task.pct       = float(pct)
+    rows.append(task)
+
+  time = re.search(r"^\s*Time:\s+" + r"\s+".join([_FLOAT] * 3), text, re.M)
+  if time:
+    record.core_time, record.wall_time, record.core_pct = map(float, time.groups())
+
+  perf = re.search(r"^\s*Performance:\s+" + _FLOAT + r"\s+" + _FLOAT, text, re.M)
+  if perf:
+    record.ns_per_day, record.hours_per_ns = map(float, perf.groups())
+
+  for key, pattern in _PATTERNS.items():
+    match = re.search(pattern, text)
+    if match:
+      record[key] = float(match.group(1))
+
+  # Percentage of steps where DLB was limited, per dimension (X 0 % Y 12 %)
+  limited = re.search(r"load balancing was limited by.*?:(.*)", text)
+  if limited:
+    record.dd_limited = max(map(float, re.findall(r"\d+(?:\.\d*)?(?=\s*%)", limited.group(1))), default = None)
+
+  end = text.find("Performance:")
+  for note in re.findall(r"^[ \t]*(NOTE:.*(?:\n[ \t]+\S.*)*)", text[:end if end > 0 else None], re.M):
+    record.notes.append(" ".join(note.split()))
+
+  return record
+
+# ---------------------------------------------------------------------------- #
+
+def diagnose(record, max_wait = 5.0, pme_range = (0.8, 1.2), max_rest = 5.0):
+  """ Flags likely misconfiguration in a performance record: time lost to
+      domain decomposition (-dds) or PP/PME (-npme) imbalance, a PME load
+      outside pme_range, and a large unaccounted "Rest" share (often
+      oversubscribed cores, i.e. nt too high). Returns a list of messages.
+  """
+
+  issues = []
+  if record is None:
+    return ["No performance data; the run did not finish its accounting."]
+
+  # item access throughout, so records read back from json work too
+  if record["dd_wait"] is not None and record["dd_wait"] > max_wait:
+    issues.append("{:.1f} % of the run time waited on domain decomposition load "
+                  "imbalance (average imbalance {} %); try other -dds/-dd settings."
+                  .format(record["dd_wait"], record["dd_imbalance"]))
+  if record["pme_wait"] is not None and record["pme_wait"] > max_wait:
+    issues.append("{:.1f} % of the run time waited on PP/PME imbalance; "
+                  "change the number of PME ranks (-npme).".format(record["pme_wait"]))
+  if record["pme_load"] is not None and not pme_range[0] <= record["pme_load"] <= pme_range[1]:
+    side = "PME" if record["pme_load"] > pme_range[1] else "PP"
+    issues.append("PME mesh/force load is {:.2f}; the {} ranks are the bottleneck."
+                  .format(record["pme_load"], side))
+  for task in record["tasks"]:
+    if task["name"] == "Rest" and task["pct"] > max_rest:
+      issues.append("{:.1f} % of the wall time is unaccounted (Rest); the cores "
+                    "may be oversubscribed (check nt and pinning).".format(task["pct"]))
+  return issues
+
+
+def compare(record, baseline, tolerance = 0.1):
+  """ Relative ns/day change of record against a baseline record, and
+      whether it is a regression (slower by more than tolerance).
+  """
+  if not record or not baseline or not record.get("ns_per_day") or not baseline.get("ns_per_day"):
+    return None, False
+  change = record["ns_per_day"] / baseline["ns_per_day"] - 1
+  return change, change < -tolerance
@@ -1 +1,6 @@
 from .mdp import mdp
+from .gro import gro
+from .ndx import ndx
+from .trr import trr
+from .xtc import xtc
+from .edr import edr
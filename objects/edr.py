@@ -0,0 +1,228 @@
+# GROMACS energy (.edr) files read without gmx energy. The term names come
+#  from the file header; the first open scans every frame header into an
+#  offset index saved next to the file, and selected terms are then gathered
+#  for all frames at once from a memory map. Version 2-5 files (GROMACS 4.0
+#  on) in either precision are read; frames that only carry data blocks are
+#  left out, as gmx energy does.
+
+import os
+import numpy as np
+from functools import partial
+from .. import cache as Cache
+from .misc import AttributeDict
+
+ENX_MAGIC   = -55555
+FRAME_MAGIC = -7777777
+
+# Byte sizes of the xdr_datatype subblock types (int, float, double, int64, char)
+_SUB_SIZES = {0: 4, 1: 4, 2: 8, 3: 8, 4: 4}
+
+INDEX_FIELDS = [("offset", np.int64), ("time", np.float64), ("step", np.int64),
+                ("nsum", np.int32), ("nre", np.int32), ("energies", np.int64),
+                ("end", np.int64)]
+
+class edr(object):
+  """ Random-access edr reader. Terms are selected by name (as listed in
+      names) or by 0-based position.
+  """
+
+  def __init__(self, path, index = True):
+    assert os.path.isfile(path), "No file found at path {}".format(path)
+    self.path       = path
+    self.index_path = path + ".idx.npy"
+
+    with open(path, 'rb') as f:
+      self.names, self.units, self.version, self._header_end = _read_names(f)
+    self.real  = _precision(path, self._header_end)
+    frames     = Cache.frame_index(path, partial(_scan, path, real = self.real), INDEX_FIELDS,
+                                   start = self._header_end, persist = index)
+    self.index = frames[frames["nre"] > 0] # others only hold data blocks
+    self._mm   = np.memmap(path, dtype = np.uint8, mode = 'r') if len(self.index) else None
+
+  def __repr__(self):
+    return "GMX EDR file: {} ({} terms, {} frames)".format(os.path.basename(self.path),
+                                                          len(self.names), len(self))
+
+  def __len__(self):
+    return len(self.index)
+
+  @property
+  def time(self):
+    return self.index["time"]
+
+  @property
+  def step(self):
+    return self.index["step"]
+
+  # -------------------------------------------------------------------------- #
+
+  def get(self, *terms, start = 0, stop = None, stride = 1):
+    """ The requested terms for frames[start:stop:stride], as an
+        (n_frames, n_terms) array, or (n_frames,) for a single term.
+    """
+    cols   = np.array([self.names.index(t) if type(t) is str else t for t in terms], dtype = np.int64)
+    frames = self.index[start:stop:stride]
+    if not len(frames):
+      return np.empty((0, len(cols)))
+
+    # Each term is one real, followed by its average and sum if nsum > 0
+    width  = np.where(frames["nsum"] > 0, 3, 1) * self.real
+    pos    = frames["energies"][:, None] + cols[None, :] * width[:, None]
+    raw    = self._mm[pos[..., None] + np.arange(self.real)]
+    values = raw.view(">f{}".format(self.real))[..., 0].astype(np.float64)
+
+    return values[:, 0] if len(terms) == 1 else values
+
+  def frame(self, i):
+    """ Every term of frame i as an AttributeDict keyed on name. """
+    values      = self.get(*range(len(self.names)), start = i, stop = i + 1 if i != -1 else None)[0]
+    frame       = AttributeDict()
+    frame.time  = float(self.index[i]["time"])
+    frame.step  = int(self.index[i]["step"])
+    for name, val in zip(self.names, values):
+      frame[name] = val
+    return frame
+
+# ---------------------------------------------------------------------------- #
+
+class _XDR(object):
+  """ Minimal big-endian XDR cursor over a bytes buffer. """
+
+  def __init__(self, buf, pos = 0):
+    self.buf, self.pos = buf, pos
+
+  def int(self):
+    self.pos += 4
+    return int(np.frombuffer(self.buf, ">i4", 1, self.pos - 4)[0])
+
+  def int64(self):
+    self.pos += 8
+    return int(np.frombuffer(self.buf, ">i8", 1, self.pos - 8)[0])
+
+  def real(self, size = 4):
+    self.pos += size
+    return float(np.frombuffer(self.buf, ">f{}".format(size), 1, self.pos - size)[0])
+
+  def string(self):
+    n = self.int()
+    s = self.buf[self.pos:self.pos + n].decode(errors = "replace")
+    self.pos += n + (-n % 4)
+    return s
+
+
+def _read_names(f):
+  """ Reads the energy term names and units at the start of the file. """
+
+  head = f.read(1 << 16)
+  x    = _XDR(head)
+  while True:
+    try:
+      magic = x.int()
+      if magic > 0:
+        raise ValueError("{}: pre-4.0 edr files aren't supported.".format(f.name))
+      if magic != ENX_MAGIC:
+        raise ValueError("{} is not a GROMACS edr file.".format(f.name))
+      version = x.int()
+      nre     = x.int()
+      names, units = [], []
+      for i in range(nre):
+        names.append(x.string())
+        units.append(x.string() if version >= 2 else "kJ/mol")
+      return names, units, version, x.pos
+    except (ValueError, IndexError):
+      if len(head) == os.fstat(f.fileno()).st_size or magic != ENX_MAGIC:
+        raise
+      # header is longer than what we read; read the whole file head again
+      f.seek(0)
+      head = f.read(len(head) * 4)
+      x    = _XDR(head)
+
+
+def _precision(path, offset):
+  """ Size of a real (4 or 8) from the -2e10 marker opening the first frame. """
+  with open(path, 'rb') as f:
+    f.seek(offset)
+    head = f.read(12)
+  if len(head) < 12:
+    return 4
+  x = _XDR(head)
+  if abs(x.real(4) + 2e10) < 1e4 and x.int() == FRAME_MAGIC:
+    return 4
+  x = _XDR(head)
+  if abs(x.real(8) + 2e10) < 1e-3 and x.int() == FRAME_MAGIC:
+    return 8
+  raise ValueError("Can't tell the precision of {}.".format(path))
+
+
+def _scan(path, offset, real, max_frames = None):
+  """ Yields an index entry for every complete frame from offset on. Frame
+      headers (and any extra data blocks) are walked to find each frame's end.
+  """
+
+  size, n = os.path.getsize(path), 0
+  with open(path, 'rb') as f:
+    while offset < size and n != max_frames:
+      f.seek(offset)
+      buf = f.read(1 << 12)
+      try:
+        entry, end = _frame_header(f, buf, offset, real)
+      except (ValueError, IndexError):
+        return # partially written last frame
+      if end > size:
+        return
+      yield entry
+      offset = end
+      n     += 1
+
+
+def _frame_header(f, buf, offset, real):
+  """ Parses the frame header at offset. Returns its index entry and end. """
+
+  x = _XDR(buf)
+  if x.real(real) > -1e-10 or x.int() != FRAME_MAGIC:
+    raise ValueError("Bad edr frame header at byte {}.".format(offset))
+  version = x.int()
+  time    = x.real(8)
+  step    = x.int64()
+  nsum    = x.int()
+  if version >= 3:
+    x.int64() # nsteps
+  if version >= 5:
+    x.real(8) # dt
+  nre    = x.int()
+  ndisre = x.int() # reserved since version 4
+  nblock = x.int()
+  dtreal = 1 if real == 4 else 2
+
+  # Block headers: id, then type and length of every subblock. Version 2-3
+  #  blocks are one subblock of reals, preceded by an optional disre block.
+  subs = []
+  if version < 4:
+    if ndisre:
+      subs += [(dtreal, ndisre), (0, ndisre)]
+    for b in range(nblock):
+      subs.append((dtreal, x.int()))
+  else:
+    for b in range(nblock):
+      x.int()
+      for i in range(x.int()):
+        subs.append((x.int(), x.int()))
+  x.int() # e_size
+  x.int() # reserved
+  x.int() # reserved
+
+  energies = offset + x.pos
+  end      = energies + nre * real * (3 if nsum > 0 else 1)
+
+  # Block data, which follows the energies
+  for kind, nr in subs:
+    if kind in _SUB_SIZES:
+      end += nr * _SUB_SIZES[kind]
+    else:
+      # strings: an int length (with the NUL), then an xdr string
+      for i in range(nr):
+        f.seek(end)
+        n    = _XDR(f.read(4)).int() - 1
+        end += 8 + n + (-n % 4)
+
+  return (offset, time, step, nsum, nre, energies, end), end
@@ -0,0 +1,250 @@
+# Fixed-width GROMACS gro files as numpy arrays. Frames are parsed by viewing
+#  each block of atom lines as a 2D byte array and slicing out the columns, so
+#  no per-atom python objects get built.
+
+import os
+import re
+import mmap
+import numpy as np
+from .misc import AttributeDict
+
+class gro(AttributeDict):
+  """ One frame of a gro file: title, time, resid, resname, name, atomid,
+      xyz (n_atoms, 3), v (n_atoms, 3) or None, and box (3 or 9 values).
+      After read_frames, xyz, v, box and time gain a leading frame axis.
+  """
+
+  def __init__(self, path = None, frame = 0):
+    super().__init__()
+    self.path = path
+    for key in ["title", "time", "resid", "resname", "name", "atomid", "xyz", "v", "box"]:
+      self[key] = None
+    if path:
+      self.load(path, frame)
+
+  def __repr__(self):
+    return "GMX GRO file: {} ({} atoms)".format(self.title, len(self.name) if self.name is not None else 0)
+
+  def load(self, path, frame = 0):
+    assert os.path.isfile(path), "No file found at path {}".format(path)
+    for i, f in enumerate(frames(path)):
+      if i == frame:
+        self.update(f)
+        self.path = path
+        return self
+    raise IndexError("{} has no frame {}.".format(path, frame))
+
+  def write(self, path, append = False, precision = 3):
+    """ Writes this frame (or every frame, if xyz is 3D) to path. """
+    if np.ndim(self.xyz) == 3:
+      frames_ = [self._frame(i) for i in range(len(self.xyz))]
+    else:
+      frames_ = [self]
+    return write_frames(path, frames_, append = append, precision = precision)
+
+  def _frame(self, i):
+    f = gro()
+    f.update(self)
+    for key in ["xyz", "v", "box", "time"]:
+      f[key] = self[key][i] if self[key] is not None else None
+    return f
+
+# ---------------------------------------------------------------------------- #
+
+def frames(path):
+  """ Yields the frames of a (multi-frame) gro file one at a time. """
+
+  with open(path, 'rb') as f:
+    if os.fstat(f.fileno()).st_size == 0:
+      return
+    buf = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+    pos = 0
+    while pos < len(buf) and buf[pos:pos + 256].strip():
+      frame, pos = _read_frame(buf, pos)
+      yield frame
+
+
+def read_frames(path):
+  """ All frames of a gro file stacked into one gro object, with xyz of shape
+      (n_frames, n_atoms, 3). Atom and residue names come from the first frame.
+  """
+
+  all_frames = list(frames(path))
+  if not all_frames:
+    raise ValueError("No frames found in {}.".format(path))
+
+  stacked = all_frames[0]
+  stacked.path = path
+  for key in ["xyz", "v", "box", "time"]:
+    if stacked[key] is not None:
+      stacked[key] = np.stack([f[key] for f in all_frames])
+  return stacked
+
+
+def write_frames(path, frames_, append = False, precision = 3):
+  """ Writes gro frames (objects with the fields of gro) to path. """
+
+  if os.path.dirname(path):
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+
+  with open(path, 'ab' if append else 'wb') as f:
+    for frame in frames_:
+      f.write(_format_frame(frame, precision))
+
+  return path
+
+# ---------------------------------------------------------------------------- #
+
+def _read_frame(buf, pos):
+  """ Parses the frame starting at byte pos. Returns it and the next offset. """
+
+  title_end = buf.find(b"\n", pos)
+  count_end = buf.find(b"\n", title_end + 1)
+  title     = buf[pos:title_end].decode().strip()
+  n_atoms   = int(buf[title_end + 1:count_end])
+  start     = count_end + 1
+
+  # Fast path: every atom line has the same length, so the block is a 2D array
+  line_len = buf.find(b"\n", start) - start + 1
+  end      = start + n_atoms * line_len
+  rows     = None
+  if end <= len(buf):
+    rows = np.frombuffer(buf, np.uint8, n_atoms * line_len, start).reshape(n_atoms, line_len)
+    if not (rows[:, -1] == ord("\n")).all():
+      rows = None
+
+  if rows is None:
+    lines, end = [], start
+    for i in range(n_atoms):
+      e = buf.find(b"\n", end)
+      lines.append(buf[end:e])
+      end = e + 1
+    width = max(len(l) for l in lines)
+    rows  = np.frombuffer(np.array(lines, dtype = "S{}".format(width)).tobytes(),
+                          np.uint8).reshape(n_atoms, width)
+
+  rows = np.where((rows == 0) | (rows == ord("\r")) | (rows == ord("\n")), ord(" "), rows).astype(np.uint8)
+
+  box_end = buf.find(b"\n", end)
+  box_end = len(buf) if box_end == -1 else box_end
+  box     = np.array(buf[end:box_end].split(), dtype = np.float64)
+
+  # Coordinate precision follows from the distance between decimal points
+  first = bytes(rows[0, 20:])
+  dots  = [m.start() for m in re.finditer(rb"\.", first)]
+  width = dots[1] - dots[0] if len(dots) > 1 else 8
+
+  frame = gro()
+  frame.title   = title
+  time          = re.search(r"t=\s*([-+\d.eE]+)", title)
+  frame.time    = float(time.group(1)) if time else None
+  frame.resid   = _column(rows, 0, 5).astype(np.int32)
+  frame.resname = np.char.strip(_column(rows, 5, 5).astype("U5"))
+  frame.name    = np.char.strip(_column(rows, 10, 5).astype("U5"))
+  frame.atomid  = _column(rows, 15, 5).astype(np.int32)
+  frame.xyz     = _fields(rows, 20, width, 3)
+  frame.v       = None
+  if len(first.rstrip()) >= 6 * width:
+    frame.v = _fields(rows, 20 + 3 * width, width, 3)
+  frame.box     = box
+
+  return frame, box_end + 1
+
+
+def _column(rows, start, width):
+  """ A fixed-width column of every row as an S array. """
+  col = np.ascontiguousarray(rows[:, start:start + width])
+  return col.view("S{}".format(width)).ravel()
+
+
+def _fields(rows, start, width, count):
+  """ count adjacent fixed-width numeric fields as an (n_rows, count) array. """
+  cols = [_column(rows, start + i * width, width).astype(np.float64) for i in range(count)]
+  return np.stack(cols, axis = 1)
+
+
+def _format_frame(frame, precision = 3):
+  """ Formats a single frame as gro text (bytes). Every column is rendered
+      into a fixed-width byte array, so no per-atom strings are built.
+  """
+
+  n     = len(frame.name)
+  # Values too large for the usual precision + 5 columns widen every
+  #  coordinate and velocity field alike (like printf would), which readers
+  #  pick up from the distance between the decimal points.
+  width = max(precision + 5, _width(frame.xyz, precision),
+              _width(frame.v, precision + 1) if frame.v is not None else 0)
+
+  cols  = [_fixed(np.asarray(frame.resid) % 100000, 5),
+           _text(frame.resname, 5, left = True),
+           _text(frame.name, 5),
+           _fixed(np.asarray(frame.atomid) % 100000, 5)]
+  cols += [_fixed(c, width, precision) for c in np.asarray(frame.xyz).T]
+  if frame.v is not None:
+    cols += [_fixed(c, width, precision + 1) for c in np.asarray(frame.v).T]
+  cols.append(np.full((n, 1), ord("\n"), np.uint8))
+
+  # Frames of a trajectory share the first title, so its time is replaced
+  title = frame.title or "Generated by gmxTools"
+  if frame.time is not None:
+    time = re.search(r"t=\s*([-+\d.eE]+)", title)
+    if time is None:
+      title += ", t= {:.5f}".format(frame.time)
+    elif float(time.group(1)) != frame.time:
+      title = title[:time.start(1)] + "{:.5f}".format(frame.time) + title[time.end(1):]
+
+  box  = "".join("{:10.5f}".format(b) for b in np.asarray(frame.box, dtype = np.float64))
+  head = "{}\n{:5d}\n".format(title, n).encode()
+  return head + np.concatenate(cols, axis = 1).tobytes() + (box + "\n").encode()
+
+
+def _width(values, decimals):
+  """ Columns needed to print every one of values with decimals decimals. """
+
+  v = np.asarray(values, dtype = np.float64).ravel()
+  if not len(v):
+    return 0
+  q      = np.round(np.abs(v) * 10 ** decimals).astype(np.int64)
+  digits = lambda m: max(len(str(int(m))), decimals + 1)
+  neg    = (v < 0) & (q > 0)
+  width  = max(digits(q.max()), digits(q[neg].max()) + 1 if neg.any() else 0)
+  return width + (1 if decimals else 0)
+
+
+def _fixed(values, width, decimals = 0):
+  """ Right-aligned fixed-point text of values as an (n, width) byte array.
+      Raises ValueError rather than drop digits of values that don't fit.
+  """
+
+  v    = np.asarray(values, dtype = np.float64)
+  if _width(v, decimals) > width:
+    raise ValueError("Values up to {} don't fit in {} columns.".format(np.abs(v).max(), width))
+  q    = np.round(np.abs(v) * 10 ** decimals).astype(np.int64)
+  out  = np.full((len(v), width), ord(" "), np.uint8)
+  lead = np.full(len(v), width - 1, np.int64) # column of the leftmost digit
+
+  col = width - 1
+  for k in range(width):
+    if decimals and k == decimals:
+      out[:, col] = ord(".")
+      col -= 1
+    if col < 0:
+      break
+    place = 10 ** k
+    shown = (q >= place) | (k <= decimals)
+    out[:, col] = np.where(shown, ord("0") + (q // place) % 10, ord(" "))
+    lead = np.where(shown, col, lead)
+    col -= 1
+
+  neg = (v < 0) & (q > 0) & (lead > 0)
+  out[np.flatnonzero(neg), lead[neg] - 1] = ord("-")
+  return out
+
+
+def _text(values, width, left = False):
+  """ Names as an (n, width) byte array, right-aligned unless left. """
+  s = np.asarray(values).astype("S{}".format(width))
+  if not left:
+    s = np.char.rjust(s, width)
+  out = s.view(np.uint8).reshape(len(s), width)
+  return np.where(out == 0, ord(" "), out).astype(np.uint8)
@@ -3,7 +3,6 @@
 # Its a glorified dictionary that can write itself to a file, at this point.
 
 import os
-from fileParser import File
 from .misc import AttributeDict
 
 class mdp(AttributeDict):
@@ -43,6 +42,7 @@ class mdp(AttributeDict):
 
   def load(self, path):
     assert os.path.isfile(path), "No file found at path {}".format(path)
+    from fileParser import File
     with File(path) as f:
       data = f.advance_to(-1, junk = ["^;", "^\n"], hold_all = True, quiet = True)
       for line in data:
@@ -1,39 +1,117 @@
-
-# Super simple object that stores each group's indices in a dictionary.
-# TODO: add support for file writing.
+# GROMACS index files. Each group is an int32 array of (1-based) atom numbers.
+#  Files are parsed in bulk, one numpy call per group, and written in chunks,
+#  so million-atom groups never become lists of python ints.
 
 import os
-from fileParser import File
-from .misc import AttributeDict, flatten2d
+import re
+import numpy as np
+from .misc import AttributeDict
+
+# Keys that describe the file rather than hold a group
+_META = ["path", "name"]
+
+class ndx(AttributeDict):
 
-  
   def __init__(self, path = None,  *args, **kwargs):
 
-    if not type(path) is str:
+    if path is not None and not type(path) is str:
       raise TypeError("Path must be a str type, not {}".format(type(path)))
 
+    super().__init__()
     self.path = path
-    self.name = os.path.splitext(os.path.basename(path))[0]
+    self.name = os.path.splitext(os.path.basename(path))[0] if path else None
 
     if self.path:
       self.load()
 
     self.update(*args, **kwargs)
 
+  def __setitem__(self, key, val):
+    if key not in _META:
+      val = np.asarray(val, dtype = np.int32).ravel()
+    super().__setitem__(key, val)
+
+  @property
+  def groups(self):
+    """ Names of the groups, in file order. """
+    return [key for key in self.keys() if key not in _META]
+
   def load(self):
     assert os.path.isfile(self.path), "No file found at path {}".format(self.path)
 
-    tf = lambda x: [int(i) for i in x.strip("\n").split()]
-    with File(self.path) as f:
-      # advance to the first group's header
-      f.advance_to("\[", junk = ["^;", "^\n"], quiet = True)
-      while not f.eof:
-        # store the header as a key
-        key = f.cl.split("[")[1].split("]")[0].replace(" ", "")
-        # get the indices as values
-        data = f.advance_to("\[", junk = ["^;", "^\n"], hold_all = True, quiet = True, tf = tf, exclude = True)
-        # format it as a list of integers
-        indices = flatten2d(data)
-        # store as a key, val pair
-        self[key] = indices
+    with open(self.path, 'rb') as f:
+      text = f.read()
+
+    # Comment lines are rare; strip them only if there are any
+    if b";" in text:
+      text = re.sub(rb";[^\n]*", b"", text)
+
+    headers = list(re.finditer(rb"^\s*\[([^\]]*)\]", text, re.M))
+    for i, header in enumerate(headers):
+      end  = headers[i + 1].start() if i + 1 < len(headers) else len(text)
+      body = text[header.end():end]
+      key  = header.group(1).decode().replace(" ", "")
+      self[key] = np.fromstring(body, dtype = np.int32, sep = " ") if body.strip() else []
+
+  def write(self, path, groups = None, chunk = 1 << 18):
+    """ Writes groups (default: all) to path in the GROMACS layout: a
+        "[ name ]" header, then the atom numbers 15 to a line. Large groups
+        are formatted chunk atoms at a time.
+    """
+
+    if os.path.dirname(path):
+      os.makedirs(os.path.dirname(path), exist_ok = True)
+
+    groups = self.groups if groups is None else groups
+    chunk  = max(chunk - chunk % 15, 15) # whole lines per chunk
+    with open(path, 'w') as f:
+      for name in groups:
+        f.write("[ {} ]\n".format(name))
+        atoms = self[name]
+        for start in range(0, len(atoms), chunk):
+          f.write(_format(atoms[start:start + chunk]))
+        f.write("\n")
+
+    return path
+
+  # -------------------------------------------------------------------------- #
+
+  def _group(self, group):
+    return self[group] if type(group) is str else np.asarray(group, dtype = np.int32)
+
+  def union(self, *groups, name = None):
+    """ Sorted atoms in any of groups (names or arrays). With name, the
+        result is also stored as a new group.
+    """
+    atoms = np.unique(np.concatenate([self._group(g) for g in groups]))
+    return self._store(atoms, name)
+
+  def intersection(self, *groups, name = None):
+    """ Sorted atoms in every one of groups. """
+    atoms = self._group(groups[0])
+    for g in groups[1:]:
+      atoms = np.intersect1d(atoms, self._group(g))
+    return self._store(np.unique(atoms), name)
+
+  def difference(self, group, *others, name = None):
+    """ Sorted atoms of group that are in none of others. """
+    atoms = self._group(group)
+    if others:
+      atoms = atoms[~np.isin(atoms, np.concatenate([self._group(g) for g in others]))]
+    return self._store(np.unique(atoms), name)
+
+  def _store(self, atoms, name):
+    atoms = atoms.astype(np.int32)
+    if name:
+      self[name] = atoms
+    return atoms
+
+# ---------------------------------------------------------------------------- #
 
+def _format(atoms):
+  """ Atom numbers as ndx text, 15 per line, each as "%4d ". """
+  full = len(atoms) - len(atoms) % 15
+  text = (("%4d " * 15 + "\n") * (full // 15)) % tuple(atoms[:full].tolist())
+  if full < len(atoms):
+    text += ("%4d " * (len(atoms) - full) + "\n") % tuple(atoms[full:].tolist())
+  return text
@@ -0,0 +1,150 @@
+# GROMACS trr trajectories read straight from disk. The first open scans the
+#  frame headers into a byte-offset index that is saved next to the file;
+#  frames are then read as views into a memory map, so random access and
+#  atom subsets only touch the pages they need.
+
+import os
+import numpy as np
+from functools import partial
+from .. import cache as Cache
+from .misc import AttributeDict
+
+MAGIC = 1993
+
+# The 13 ints after the version string of every frame header
+_SIZES = ["ir_size", "e_size", "box_size", "vir_size", "pres_size", "top_size",
+          "sym_size", "x_size", "v_size", "f_size", "natoms", "step", "nre"]
+
+INDEX_FIELDS = [("offset", np.int64), ("step", np.int64), ("time", np.float64),
+                ("lambda", np.float64), ("natoms", np.int32), ("real", np.int8),
+                ("box", np.int64), ("x", np.int64), ("v", np.int64), ("f", np.int64),
+                ("end", np.int64)]
+
+class trr(object):
+  """ Random-access trr reader. atoms arguments take 1-based GROMACS indices,
+      e.g. a group from an ndx file.
+  """
+
+  def __init__(self, path, index = True):
+    assert os.path.isfile(path), "No file found at path {}".format(path)
+    self.path       = path
+    self.index_path = path + ".idx.npy"
+    self.index      = Cache.frame_index(path, partial(_scan, path), INDEX_FIELDS, persist = index)
+    self._mm        = np.memmap(path, dtype = np.uint8, mode = 'r') if len(self.index) else None
+
+  def __repr__(self):
+    return "GMX TRR file: {} ({} frames)".format(os.path.basename(self.path), len(self))
+
+  def __len__(self):
+    return len(self.index)
+
+  def __getitem__(self, i):
+    if isinstance(i, slice):
+      return [self.frame(j) for j in range(*i.indices(len(self)))]
+    return self.frame(i)
+
+  def __iter__(self):
+    return self.frames()
+
+  # -------------------------------------------------------------------------- #
+
+  def frame(self, i, atoms = None):
+    """ Frame i as an AttributeDict with step, time, lambd (lambda), box, x,
+        v and f (arrays are None when the frame doesn't hold them).
+    """
+    entry = self.index[i]
+    real  = ">f{}".format(entry["real"])
+    idx   = _atom_index(atoms)
+
+    frame        = AttributeDict()
+    frame.step   = int(entry["step"])
+    frame.time   = float(entry["time"])
+    frame.lambd  = float(entry["lambda"])
+    frame.box    = self._array(entry["box"], real, (3, 3)).astype(real[1:]) if entry["box"] >= 0 else None
+    for key in ["x", "v", "f"]:
+      if entry[key] >= 0:
+        arr = self._array(entry[key], real, (entry["natoms"], 3))
+        frame[key] = (arr if idx is None else arr[idx]).astype(real[1:])
+      else:
+        frame[key] = None
+    return frame
+
+  def frames(self, start = 0, stop = None, stride = 1, atoms = None):
+    """ Iterates over frames[start:stop:stride]. """
+    for i in range(*slice(start, stop, stride).indices(len(self))):
+      yield self.frame(i, atoms)
+
+  def read(self, key = "x", start = 0, stop = None, stride = 1, atoms = None):
+    """ One quantity (x, v, f or box) for a range of frames, as an array of
+        shape (n_frames, n_atoms, 3).
+    """
+    frames = range(*slice(start, stop, stride).indices(len(self)))
+    idx    = _atom_index(atoms)
+    out    = None
+    for n, i in enumerate(frames):
+      entry = self.index[i]
+      if entry[key] < 0:
+        raise ValueError("Frame {} of {} has no {}.".format(i, self.path, key))
+      shape = (3, 3) if key == "box" else (entry["natoms"], 3)
+      arr   = self._array(entry[key], ">f{}".format(entry["real"]), shape)
+      arr   = arr if idx is None or key == "box" else arr[idx]
+      if out is None:
+        out = np.empty((len(frames),) + arr.shape, dtype = arr.dtype.newbyteorder("="))
+      out[n] = arr
+    return out if out is not None else np.empty((0, 0, 3))
+
+  # -------------------------------------------------------------------------- #
+
+  def _array(self, offset, dtype, shape):
+    return np.ndarray(shape, dtype = dtype, buffer = self._mm, offset = int(offset))
+
+# ---------------------------------------------------------------------------- #
+
+def _scan(path, offset = 0, max_frames = None):
+  """ Yields an index entry for every complete frame from offset on. """
+
+  size, n = os.path.getsize(path), 0
+  with open(path, 'rb') as f:
+    while offset + 24 + 13 * 4 + 8 <= size and n != max_frames:
+      f.seek(offset)
+      head  = f.read(24 + 13 * 4 + 16)
+      magic = int(np.frombuffer(head, ">i4", 1, 0)[0])
+      if magic != MAGIC:
+        raise ValueError("Bad trr magic number at byte {} of {}.".format(offset, path))
+
+      slen  = int(np.frombuffer(head, ">i4", 1, 8)[0])
+      pos   = 12 + slen + (-slen % 4)
+      sizes = dict(zip(_SIZES, np.frombuffer(head, ">i4", 13, pos).tolist()))
+      pos  += 13 * 4
+
+      natoms = sizes["natoms"]
+      if sizes["box_size"]:
+        real = sizes["box_size"] // 9
+      elif natoms:
+        real = max(sizes["x_size"], sizes["v_size"], sizes["f_size"]) // (natoms * 3)
+      else:
+        real = 4
+      t, lam = np.frombuffer(head, ">f{}".format(real), 2, pos)
+      pos   += 2 * real
+
+      blocks = {}
+      for key, name in [("box", "box_size"), (None, "vir_size"), (None, "pres_size"),
+                        ("x", "x_size"), ("v", "v_size"), ("f", "f_size")]:
+        if key:
+          blocks[key] = offset + pos if sizes[name] else -1
+        pos += sizes[name]
+
+      if offset + pos > size:
+        return # partially written last frame
+
+      yield (offset, sizes["step"], t, lam, natoms, real,
+             blocks["box"], blocks["x"], blocks["v"], blocks["f"], offset + pos)
+      offset += pos
+      n      += 1
+
+
+def _atom_index(atoms):
+  """ 1-based GROMACS atom numbers to 0-based array indices. """
+  if atoms is None:
+    return None
+  return np.asarray(atoms, dtype = np.int64) - 1
@@ -1,21 +1,86 @@
 from utils.gmx.xvg import xvg
 from argparse import ArgumentParser as AP
+from concurrent.futures import ProcessPoolExecutor
+import os
+import glob
+from sys import exit
 
-def main(name, labels = None, print_labels = False):
+def main(name, labels = None, print_labels = False, lod = True):
   a = xvg(name)
   if print_labels: print("Labels: {}\nUnits: {}".format(a.labels, a.units))
   if labels:
-    a.plot(labels)
+    a.plot(labels, lod = lod)
   else:
-    a.plot()
+    a.plot(lod = lod)
   return a
 
+def batch(names, out_dir, labels = None, fmt = "png", lod = True, processes = None):
+  """ Renders many xvg files (list and/or glob patterns) to out_dir with a
+      non-interactive backend, in parallel. Outputs mirror the inputs' paths
+      below their common directory, so run1/energy.xvg and run2/energy.xvg
+      become out_dir/run1/energy.png and out_dir/run2/energy.png. Inputs
+      whose rendered output is newer than the xvg are skipped.
+      Returns {xvg path: output path} for the files rendered; a file that
+      failed maps to its exception instead, so one bad file doesn't stop the
+      batch.
+  """
+
+  paths = [p for name in names for p in (sorted(glob.glob(name)) or [name])]
+  if not paths:
+    return {}
+  root = os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in paths])
+
+  jobs = []
+  for path in paths:
+    rel = os.path.relpath(os.path.abspath(path), root)
+    out = os.path.join(out_dir, "{}.{}".format(os.path.splitext(rel)[0], fmt))
+    if os.path.isfile(out) and os.path.getmtime(out) >= os.path.getmtime(path):
+      continue
+    os.makedirs(os.path.dirname(out) or ".", exist_ok = True)
+    jobs.append((path, out))
+
+  results = {}
+  with ProcessPoolExecutor(max_workers = processes) as pool:
+    futures = [(path, pool.submit(_render, (path, out), labels, lod)) for path, out in jobs]
+    for path, fut in futures:
+      try:
+        results[path] = fut.result()
+      except Exception as e:
+        results[path] = e
+
+  return results
+
+def _render(job, labels = None, lod = True):
+  import matplotlib.pyplot as plt
+  plt.switch_backend("Agg")
+  path, out = job
+  a = xvg(path)
+  if labels:
+    a.plot(labels, lod = lod, out = out)
+  else:
+    a.plot(lod = lod, out = out)
+  return out
+
 if __name__ == "__main__":
   parser = AP("Plot an xvg file with python because xmgrace doesn't work on degennes :(")
-  parser.add_argument("-f", "--file_in", required = True)
+  parser.add_argument("-f", "--file_in", required = True, nargs = "+")
   parser.add_argument("-l", "--labels", nargs = "+", default = None)
   parser.add_argument("-s", "--show_labels", default = False, action='store_true')
+  parser.add_argument("-a", "--all_points", default = False, action='store_true',
+                      help = "plot every point instead of a decimated series")
+  parser.add_argument("-o", "--out_dir", default = None,
+                      help = "render headlessly into this directory (batch mode)")
+  parser.add_argument("--format", default = "png", help = "batch output format, e.g. png or pdf")
+  parser.add_argument("-j", "--processes", type = int, default = None)
   d = parser.parse_args()
-  main(d.file_in, d.labels, d.show_labels)
-
-
+  if d.out_dir:
+    results = batch(d.file_in, d.out_dir, d.labels, d.format, lod = not d.all_points,
+                    processes = d.processes)
+    failed  = {p: e for p, e in results.items() if isinstance(e, Exception)}
+    for path, e in failed.items():
+      print("Failed to plot {}: {}".format(path, e))
+    if failed:
+      exit(1)
+  else:
+    for name in d.file_in:
+      main(name, d.labels, d.show_labels, lod = not d.all_points)
@@ -0,0 +1,20 @@
+# The package imports as utils.gmx; map this checkout to that name so the
+#  tests run from a plain clone.
+
+import os
+import sys
+import types
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if "utils.gmx" not in sys.modules:
+  if "utils" not in sys.modules:
+    utils = types.ModuleType("utils")
+    utils.__path__ = []
+    sys.modules["utils"] = utils
+  spec = importlib.util.spec_from_file_location("utils.gmx", os.path.join(ROOT, "__init__.py"),
+                                                submodule_search_locations = [ROOT])
+  module = importlib.util.module_from_spec(spec)
+  sys.modules["utils.gmx"] = module
+  spec.loader.exec_module(module)
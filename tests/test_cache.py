@@ -0,0 +1,47 @@
+import numpy as np
+
+from utils.gmx import cache as Cache
+
+FIELDS = [("offset", np.int64), ("value", np.int64), ("end", np.int64)]
+
+
+def records(path, offset, calls, max_frames = None):
+  """ Index entries of a file of 8-byte big-endian records. """
+  calls.append(offset)
+  data = open(path, 'rb').read()
+  n    = 0
+  while offset + 8 <= len(data) and n != max_frames:
+    yield (offset, int.from_bytes(data[offset:offset + 8], "big"), offset + 8)
+    offset += 8
+    n      += 1
+
+
+def test_frame_index_is_reused_extended_and_rebuilt(tmp_path):
+  path  = str(tmp_path / "frames.bin")
+  calls = []
+  scan  = lambda offset, max_frames = None: records(path, offset, calls, max_frames)
+  with open(path, 'wb') as f:
+    f.write(b"".join(i.to_bytes(8, "big") for i in range(3)))
+
+  index = Cache.frame_index(path, scan, FIELDS)
+  assert list(index["value"]) == [0, 1, 2]
+  assert calls == [0]
+
+  # Reused: only the last entry is checked, then the (empty) tail scanned
+  calls.clear()
+  assert np.array_equal(Cache.frame_index(path, scan, FIELDS), index)
+  assert calls == [16, 24]
+
+  # Extended when the file grows
+  with open(path, 'ab') as f:
+    f.write((3).to_bytes(8, "big"))
+  calls.clear()
+  assert list(Cache.frame_index(path, scan, FIELDS)["value"]) == [0, 1, 2, 3]
+  assert calls == [16, 24]
+
+  # Rebuilt when the indexed frames changed
+  with open(path, 'wb') as f:
+    f.write(b"".join(i.to_bytes(8, "big") for i in range(10, 14)))
+  calls.clear()
+  assert list(Cache.frame_index(path, scan, FIELDS)["value"]) == [10, 11, 12, 13]
+  assert calls == [24, 0]
@@ -0,0 +1,24 @@
+import os
+
+from utils.gmx import gmx as Gmx
+
+
+def test_campaign_status_only_rereads_changed_runs(tmp_path, monkeypatch):
+  for run in ["a/r1", "a/r2", "b/r3"]:
+    os.makedirs(tmp_path / os.path.dirname(run), exist_ok = True)
+    (tmp_path / (run + ".tpr")).write_bytes(b"tpr")
+
+  calls = []
+  monkeypatch.setattr(Gmx, "run_status", lambda tpr: calls.append(tpr) or "not started")
+
+  status = Gmx.campaign_status(str(tmp_path))
+  assert sorted(os.path.relpath(t, tmp_path) for t in status) == ["a/r1.tpr", "a/r2.tpr", "b/r3.tpr"]
+  assert len(calls) == 3
+
+  calls.clear()
+  assert Gmx.campaign_status(str(tmp_path)) == status
+  assert calls == []
+
+  (tmp_path / "a" / "r2.log").write_text("Started mdrun\n")
+  assert Gmx.campaign_status(str(tmp_path)) == status
+  assert calls == [str(tmp_path / "a" / "r2.tpr")]
@@ -0,0 +1,55 @@
+import struct
+import numpy as np
+
+from utils.gmx.objects.edr import edr as Edr
+
+NAMES = [("Bond", "kJ/mol"), ("Potential", "kJ/mol"), ("Temperature", "K")]
+
+
+def xdr_string(s):
+  b = s.encode()
+  return struct.pack(">I", len(b)) + b + b"\0" * (-len(b) % 4)
+
+
+def edr_file(frames, real = 4, nsum = 0):
+  """ A version 5 edr file: the term names, then one frame per
+      (step, time, values) with no extra data blocks.
+  """
+  dtype = ">f{}".format(real)
+  out   = struct.pack(">iii", -55555, 5, len(NAMES))
+  for name, unit in NAMES:
+    out += xdr_string(name) + xdr_string(unit)
+  for step, time, values in frames:
+    out += np.array([-2e10], dtype).tobytes() + struct.pack(">ii", -7777777, 5)
+    out += struct.pack(">dqiqd", time, step, nsum, 1, 0.002)
+    out += struct.pack(">iii", len(NAMES), 0, 0) + struct.pack(">iii", 0, 0, 0)
+    values = np.asarray(values, np.float64)
+    if nsum > 0:
+      values = np.column_stack([values, values, values * nsum]).ravel() # value, average, sum
+    out += values.astype(dtype).tobytes()
+  return out
+
+
+FRAMES = [(0, 0.0, [1.0, -100.0, 300.0]), (10, 0.02, [1.5, -101.0, 299.0]),
+          (20, 0.04, [2.0, -102.5, 301.0])]
+
+
+def test_reads_terms_in_both_precisions(tmp_path):
+  for real, nsum in [(4, 0), (8, 0), (4, 5)]:
+    path = tmp_path / "ener{}{}.edr".format(real, nsum)
+    path.write_bytes(edr_file(FRAMES, real = real, nsum = nsum))
+
+    energy = Edr(str(path))
+    assert energy.names == [n for n, _ in NAMES]
+    assert energy.units == [u for _, u in NAMES]
+    assert list(energy.step) == [0, 10, 20]
+    assert np.allclose(energy.time, [0.0, 0.02, 0.04])
+    assert np.allclose(energy.get("Potential"), [-100.0, -101.0, -102.5])
+    assert np.allclose(energy.get("Temperature", 0), [[300, 1.0], [299, 1.5], [301, 2.0]])
+    assert np.isclose(energy.frame(-1).Bond, 2.0)
+
+
+def test_partial_last_frame_is_left_out(tmp_path):
+  path = tmp_path / "running.edr"
+  path.write_bytes(edr_file(FRAMES)[:-6])
+  assert len(Edr(str(path), index = False)) == 2
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from utils.gmx.objects.gro import gro as Gro, read_frames, _fixed
+
+FRAME = """Water in water t= {:.5f}
+    2
+    1SOL     OW    1   0.126   1.624   1.679  0.1227 -0.0580  0.0434
+    1SOL    HW1    2   0.190   1.661   1.747  0.8085  0.3191 -0.7791
+   1.86206   1.86206   1.86206
+"""
+
+
+def test_frames_keep_their_own_time(tmp_path):
+  src = tmp_path / "traj.gro"
+  src.write_text(FRAME.format(0.0) + FRAME.format(10.0) + FRAME.format(20.0))
+
+  out = read_frames(str(src)).write(str(tmp_path / "copy.gro"))
+  again = read_frames(out)
+  assert np.allclose(again.time, [0.0, 10.0, 20.0])
+  assert np.allclose(again.xyz, read_frames(str(src)).xyz)
+
+
+def test_large_values_widen_the_fields(tmp_path):
+  src = tmp_path / "one.gro"
+  src.write_text(FRAME.format(0.0))
+  frame = Gro(str(src))
+  frame.xyz = np.array([[-1234.567, 12345.678, 0.5], [1.0, -2.0, 3.0]])
+
+  out   = frame.write(str(tmp_path / "wide.gro"))
+  again = Gro(out)
+  assert np.allclose(again.xyz, frame.xyz)
+  assert np.allclose(again.v, frame.v)
+
+
+def test_fixed_never_truncates():
+  with pytest.raises(ValueError):
+    _fixed(np.array([-123.456]), 7, 3)
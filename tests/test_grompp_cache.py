@@ -0,0 +1,72 @@
+import os
+import sys
+import pytest
+
+pytest.importorskip("fileParser")
+
+from utils.gmx import gmx as Gmx
+from conftest import ROOT
+
+STANDIN = "{} {}".format(sys.executable, os.path.join(ROOT, "benchmarks", "gmx_standin.py"))
+
+
+@pytest.fixture
+def inputs(tmp_path):
+  (tmp_path / "run.mdp").write_text("integrator = md\nnsteps = 100\n")
+  (tmp_path / "conf.gro").write_text("box\n1\n    1SOL     OW    1   0.000   0.000   0.000\n   1.0   1.0   1.0\n")
+  (tmp_path / "ff.itp").write_text("[ defaults ]\n1 2 yes 0.5 0.8333\n")
+  (tmp_path / "topol.top").write_text('#include "ff.itp"\n\n[ system ]\nwater\n')
+  return tmp_path
+
+
+def grompp(d, o):
+  return Gmx.grompp(f = str(d / "run.mdp"), c = str(d / "conf.gro"), p = str(d / "topol.top"),
+                    o = str(d / o), po = str(d / (o + ".mdp")), executable = STANDIN,
+                    cache = str(d / "cache"))
+
+
+def cached_tprs(d):
+  return sorted(p for p in os.listdir(d / "cache") if p.endswith(".tpr"))
+
+
+def test_miss_hit_and_include_invalidation(inputs, capsys):
+  d = inputs
+
+  grompp(d, "a.tpr")
+  assert "Cached" not in capsys.readouterr().out
+  assert len(cached_tprs(d)) == 1
+  first = os.path.join(d / "cache", cached_tprs(d)[0])
+  assert (d / "a.tpr").read_bytes() == open(first, 'rb').read()
+  assert os.stat(d / "a.tpr").st_ino != os.stat(first).st_ino
+
+  # Same inputs: the cached tpr is copied in place, grompp doesn't run. The
+  # earlier output is left alone, and editing the copy leaves the cache intact.
+  os.utime(d / "a.tpr", (1, 1))
+  grompp(d, "b.tpr")
+  assert "Cached" in capsys.readouterr().out
+  assert (d / "b.tpr").read_bytes() == (d / "a.tpr").read_bytes()
+  assert os.stat(d / "a.tpr").st_mtime == 1
+  with open(d / "b.tpr", 'ab') as f:
+    f.write(b"edited")
+  assert open(first, 'rb').read() == (d / "a.tpr").read_bytes()
+  assert len(cached_tprs(d)) == 1
+
+  # Editing an #included file changes the key
+  (d / "ff.itp").write_text("[ defaults ]\n1 2 yes 1.0 1.0\n")
+  grompp(d, "c.tpr")
+  assert "Cached" not in capsys.readouterr().out
+  assert len(cached_tprs(d)) == 2
+
+
+def test_async_grompp_fills_the_cache(inputs, capsys):
+  import asyncio
+  d = inputs
+
+  asyncio.run(Gmx.agrompp(f = str(d / "run.mdp"), c = str(d / "conf.gro"), p = str(d / "topol.top"),
+                          o = str(d / "a.tpr"), po = str(d / "a.mdp"), executable = STANDIN,
+                          cache = str(d / "cache")))
+  assert len(cached_tprs(d)) == 1
+
+  grompp(d, "b.tpr")
+  assert "Cached" in capsys.readouterr().out
+  assert (d / "b.tpr").read_bytes() == (d / "a.tpr").read_bytes()
@@ -0,0 +1,81 @@
+import os
+import shutil
+import pytest
+
+from utils.gmx import gmx as Gmx
+from utils.gmx import mdlog as Mdlog
+from conftest import ROOT
+
+LOG = os.path.join(ROOT, "tests", "data", "md.log")
+
+
+def test_parse_log_reads_throughput_and_breakdown():
+  record = Mdlog.parse_log(LOG)
+  assert record.ns_per_day == pytest.approx(70.810)
+  assert record.hours_per_ns == pytest.approx(0.339)
+  assert (record.core_time, record.wall_time, record.core_pct) == pytest.approx((97.617, 12.203, 800.0))
+  assert (record.ranks, record.threads) == (8, 2)
+
+  tasks = {t.name: t for t in record.tasks}
+  assert list(tasks)[0] == "Domain decomp." and list(tasks)[-1] == "Total"
+  assert (tasks["Force"].ranks, tasks["Force"].threads, tasks["Force"].calls) == (6, 2, 501)
+  assert tasks["Force"].wall_time == pytest.approx(7.770)
+  assert tasks["Rest"].calls is None and tasks["Rest"].pct == pytest.approx(7.5)
+  assert [t.name for t in record.pme_tasks] == ["PME redist. X/F", "PME spread", "PME gather", "PME 3D-FFT"]
+
+  assert (record.dd_imbalance, record.dd_wait, record.dd_limited) == pytest.approx((3.5, 1.2, 12.0))
+  assert (record.pme_load, record.pme_wait, record.lost) == pytest.approx((1.312, 6.5, 7.1))
+  assert record.notes == ["NOTE: 7.1 % of the available CPU time was lost due to load imbalance "
+                          "in the domain decomposition."]
+
+
+def test_parse_log_segments(tmp_path):
+  text = open(LOG).read()
+  path = tmp_path / "md.log"
+  path.write_text(text + text.replace("70.810", "35.405") + "Started mdrun on rank 0\n")
+
+  assert Mdlog.parse_log(str(path)).ns_per_day == pytest.approx(35.405)
+  records = Mdlog.parse_log(str(path), segments = True)
+  assert [r.ns_per_day for r in records] == pytest.approx([70.810, 35.405])
+
+  path.write_text(text[:text.index(" M E G A")])
+  assert Mdlog.parse_log(str(path)) is None
+  assert Mdlog.parse_log(str(tmp_path / "missing.log")) is None
+
+
+def test_diagnose_and_compare():
+  record = Mdlog.parse_log(LOG)
+  issues = Mdlog.diagnose(record)
+  assert len(issues) == 3
+  assert "-npme" in issues[0] and "PME ranks are the bottleneck" in issues[1] and "Rest" in issues[2]
+  assert Mdlog.diagnose(record, max_wait = 10, pme_range = (0.5, 1.5), max_rest = 10) == []
+  assert Mdlog.diagnose(None) == ["No performance data; the run did not finish its accounting."]
+
+  faster = dict(record, ns_per_day = 2 * record.ns_per_day)
+  assert Mdlog.compare(faster, record) == (pytest.approx(1.0), False)
+  assert Mdlog.compare(record, faster) == (pytest.approx(-0.5), True)
+  assert Mdlog.compare(record, faster, tolerance = 0.6)[1] is False
+  assert Mdlog.compare(None, record) == (None, False)
+
+
+def test_campaign_performance(tmp_path, monkeypatch):
+  for run in ["a/r1", "b/r2"]:
+    os.makedirs(tmp_path / os.path.dirname(run), exist_ok = True)
+    (tmp_path / (run + ".tpr")).write_bytes(b"tpr")
+  shutil.copy(LOG, tmp_path / "a" / "r1.log")
+  r1 = str(tmp_path / "a" / "r1.tpr")
+
+  first = Gmx.campaign_performance(str(tmp_path))
+  assert list(first) == [r1] # r2 has no log yet
+  assert first[r1]["ns_per_day"] == pytest.approx(70.810)
+  assert len(first[r1]["issues"]) == 3
+  assert "change" not in first[r1]
+
+  # Unchanged logs come from the index; the baseline adds the change
+  calls = []
+  monkeypatch.setattr(Gmx.Mdlog, "parse_log", lambda log: calls.append(log))
+  baseline = {r1: dict(first[r1], ns_per_day = 100.0)}
+  again    = Gmx.campaign_performance(str(tmp_path), baseline = baseline)
+  assert calls == []
+  assert again[r1]["change"] == pytest.approx(-0.2919)
+  assert again[r1]["regression"] is True
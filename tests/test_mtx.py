@@ -0,0 +1,46 @@
+import struct
+import numpy as np
+import pytest
+
+pytest.importorskip("scipy")
+
+from utils.gmx import gmx as Gmx
+
+HESSIAN = np.array([[4.0, -1.0, 0.0, 0.5],
+                    [-1.0, 3.0, 2.0, 0.0],
+                    [0.0, 2.0, 5.0, -0.25],
+                    [0.5, 0.0, -0.25, 1.0]])
+
+
+def header(version, prec, nrow, ncol, kind):
+  """ gmx_mtxio_write's header: magic, gmx_fio string, precision, shape, storage. """
+  text = version.encode()
+  pad  = b"\0" * (-len(text) % 4)
+  return (struct.pack(">iiI", 0x34ce8fd2, len(text) + 1, len(text)) + text + pad +
+          struct.pack(">iiii", prec, nrow, ncol, kind))
+
+
+def test_full_single_precision(tmp_path):
+  path = tmp_path / "full.mtx"
+  path.write_bytes(header("VERSION 2018.8", 0, 4, 4, 0) + HESSIAN.astype(">f4").tobytes())
+  assert np.allclose(Gmx.load_mtx(str(path)).toarray(), HESSIAN)
+
+
+def test_sparse_symmetric_double_precision(tmp_path):
+  body = struct.pack(">ii", 1, 4)
+  rows = [[(c, HESSIAN[r, c]) for c in range(r, 4) if HESSIAN[r, c] != 0] for r in range(4)]
+  body += struct.pack(">4i", *[len(r) for r in rows])
+  for r in rows:
+    for col, value in r:
+      body += struct.pack(">id", col, value)
+
+  path = tmp_path / "sparse.mtx"
+  path.write_bytes(header("2021.4", 1, 4, 4, 1) + body)
+  assert np.allclose(Gmx.load_mtx(str(path)).toarray(), HESSIAN)
+
+
+def test_rejects_other_files(tmp_path):
+  path = tmp_path / "bad.mtx"
+  path.write_bytes(b"\0" * 64)
+  with pytest.raises(ValueError):
+    Gmx.load_mtx(str(path))
@@ -0,0 +1,60 @@
+import os
+import sys
+import struct
+import pytest
+
+pytest.importorskip("fileParser")
+
+from utils.gmx import gmx as Gmx
+from conftest import ROOT
+
+STANDIN = "{} {}".format(sys.executable, os.path.join(ROOT, "benchmarks", "gmx_standin.py"))
+
+
+def test_valid_checkpoint(tmp_path):
+  good = tmp_path / "md.cpt"
+  good.write_bytes(struct.pack(">i", Gmx.CPT_MAGIC1) + bytes(32) + struct.pack(">i", Gmx.CPT_MAGIC2))
+  assert Gmx.valid_checkpoint(str(good))
+
+  (tmp_path / "cut.cpt").write_bytes(good.read_bytes()[:20])
+  (tmp_path / "other.cpt").write_bytes(bytes(40))
+  (tmp_path / "empty.cpt").write_bytes(b"")
+  for name in ["cut.cpt", "other.cpt", "empty.cpt", "missing.cpt"]:
+    assert not Gmx.valid_checkpoint(str(tmp_path / name))
+
+  # A truncated checkpoint falls back to the previous one
+  deffnm = str(tmp_path / "md")
+  assert Gmx.latest_checkpoint(deffnm) == deffnm + ".cpt"
+  os.replace(good, tmp_path / "md_prev.cpt")
+  (tmp_path / "md.cpt").write_bytes(b"\0\2")
+  assert Gmx.latest_checkpoint(deffnm) == deffnm + "_prev.cpt"
+  assert Gmx.find_checkpoint(deffnm + ".tpr") == deffnm + "_prev.cpt"
+  os.remove(tmp_path / "md_prev.cpt")
+  assert Gmx.latest_checkpoint(deffnm) is None
+
+
+def test_segments_resume_from_the_last_intact_checkpoint(tmp_path, monkeypatch):
+  monkeypatch.chdir(tmp_path)
+  (tmp_path / "md.tpr").write_bytes(b"")
+  run = dict(maxh = 0.05, executable = STANDIN, nsteps = 1000, nt = 1) # 180 steps a segment
+
+  files   = Gmx.mdrun_segments("md", segments = 2, **run)
+  records = files["segments"]
+  assert [r["status"] for r in records] == ["stopped", "stopped"]
+  assert [r["cpi"] for r in records] == [None, "md.cpt"]
+  assert [r["step"] for r in records] == [180, 360]
+  assert not Gmx.check_successful("md.log")
+
+  # The newest checkpoint is cut short: continue from the one before it
+  with open("md.cpt", 'r+b') as f:
+    f.truncate(6)
+  records = Gmx.mdrun_segments("md", **run)["segments"]
+  assert records[2]["cpi"] == "md_prev.cpt"
+  assert records[2]["step"] == 360
+  assert [r["cpi"] for r in records[3:]] == ["md.cpt"] * (len(records) - 3)
+  assert records[-1]["status"] == "finished"
+  assert records[-1]["step"] == 1000
+  assert Gmx.check_successful("md.log")
+
+  # A finished run isn't started again
+  assert len(Gmx.mdrun_segments("md", **run)["segments"]) == len(records)
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from utils.gmx import selection as Sel
+from utils.gmx.objects.ndx import ndx as Ndx
+from utils.gmx.objects.misc import AttributeDict
+
+ATOMS = [(1, "SOL", "OW",  0.1, 0.1, 0.1), (1, "SOL", "HW1", 0.2, 0.1, 0.1),
+         (2, "SOL", "OW",  2.9, 0.1, 0.1), (2, "SOL", "HW1", 2.8, 0.1, 0.1),
+         (3, "NA",  "NA",  1.5, 1.5, 1.5), (4, "CL",  "CL",  1.5, 1.5, 2.0)]
+
+
+@pytest.fixture
+def gro(tmp_path):
+  path  = tmp_path / "conf.gro"
+  lines = ["ions in water", "{:5d}".format(len(ATOMS))]
+  for i, (resid, resname, name, x, y, z) in enumerate(ATOMS):
+    lines.append("{:5d}{:<5s}{:>5s}{:5d}{:8.3f}{:8.3f}{:8.3f}".format(resid, resname, name, i + 1, x, y, z))
+  lines.append("   3.00000   3.00000   3.00000")
+  path.write_text("\n".join(lines) + "\n")
+  return str(path)
+
+
+def test_names_ranges_and_coordinates(gro):
+  assert list(Sel.select(gro, "name HW?")) == [2, 4]
+  assert list(Sel.select(gro, "resname N* C?")) == [5, 6]
+  assert list(Sel.select(gro, "name OW HW1")) == [1, 2, 3, 4]
+  assert list(Sel.select(gro, "resid 1 to 2")) == [1, 2, 3, 4]
+  assert list(Sel.select(gro, "resid 1 3")) == [1, 2, 5]
+  assert list(Sel.select(gro, "atomnr 5-6")) == [5, 6]
+  assert list(Sel.select(gro, "z > 1.7")) == [6]
+  assert list(Sel.select(gro, "all")) == [1, 2, 3, 4, 5, 6]
+  assert len(Sel.select(gro, "none")) == 0
+  assert Sel.select(gro, "all").dtype == np.int32
+
+
+def test_precedence_and_groups(gro):
+  # not binds tighter than and, which binds tighter than or
+  assert list(Sel.select(gro, "not name OW and resid 1 or resname CL")) == [2, 6]
+  assert list(Sel.select(gro, "not (name OW or name HW1)")) == [5, 6]
+  assert list(Sel.select(gro, "resname NA or resname CL and z < 1.7")) == [5]
+
+  groups = {"Ion": [5, 6], "Water and ions": [1, 5]}
+  assert list(Sel.select(gro, "group Ion and not resname NA", groups)) == [6]
+  assert list(Sel.select(gro, 'Ion or "Water and ions"', groups)) == [1, 5, 6]
+
+  for bad in ["name", "resid 1 )", "(name OW", "mass > 1", "x ~ 1", "group Missing"]:
+    with pytest.raises(ValueError):
+      Sel.select(gro, bad, groups)
+
+
+def test_within_is_periodic(gro):
+  pytest.importorskip("scipy")
+  # atom 3 is 0.2 nm from atom 1 through the x boundary, atom 4 is 0.3 nm
+  assert list(Sel.select(gro, "within 0.25 of atomnr 1")) == [1, 2, 3]
+  assert list(Sel.select(gro, "within 0.25 of atomnr 1", pbc = False)) == [1, 2]
+  assert list(Sel.select(gro, "same residue as within 0.25 of atomnr 1")) == [1, 2, 3, 4]
+  assert list(Sel.select(gro, "within 0.6 of resname NA and not resname NA")) == [6]
+  assert len(Sel.select(gro, "within 0.5 of none")) == 0
+
+
+def test_within_matches_brute_force():
+  pytest.importorskip("scipy")
+  rng  = np.random.default_rng(7)
+  box  = np.array([4.0, 5.0, 6.0])
+  conf = AttributeDict() # any object with the gro fields will do
+  conf.xyz     = rng.random((2000, 3)) * box
+  conf.box     = box
+  conf.name    = np.array(["C"] * 2000)
+  conf.resname = np.array(["MOL"] * 2000)
+  conf.resid   = np.arange(1, 2001)
+
+  for ref in ["atomnr 1-5", "atomnr 1-1500"]: # sparse and dense references
+    lo, hi = map(int, ref.split()[1].split("-"))
+    for pbc in [True, False]:
+      d = conf.xyz[:, None] - conf.xyz[None, lo - 1:hi]
+      if pbc:
+        d -= box * np.round(d / box)
+      expected = np.flatnonzero((np.linalg.norm(d, axis = -1) <= 0.7).any(axis = 1)) + 1
+      assert np.array_equal(Sel.select(conf, "within 0.7 of " + ref, pbc = pbc), expected)
+
+def test_index_groups_refer_to_earlier_ones(gro, tmp_path):
+  existing = Ndx()
+  existing["System"] = np.arange(1, 7)
+  path = str(tmp_path / "index.ndx")
+
+  out = Sel.index_groups(gro, {"Water": "resname SOL", "Oxygens": "Water and name OW",
+                               "Rest": "System and not Water"}, groups = existing, path = path)
+  assert out.groups == ["System", "Water", "Oxygens", "Rest"]
+  assert list(out["Oxygens"]) == [1, 3]
+  assert list(out["Rest"]) == [5, 6]
+
+  again = Ndx(path)
+  assert again.groups == out.groups
+  assert all(np.array_equal(again[g], out[g]) for g in out.groups)
@@ -0,0 +1,16 @@
+import pytest
+
+from utils.gmx import gmx as Gmx
+
+
+def test_bad_thread_counts_fail_only_their_job(monkeypatch):
+  monkeypatch.setattr(Gmx, "simulate", lambda **kwargs: (kwargs["nt"], kwargs["pinoffset"]))
+  specs   = [{"nt": 0}, {"nt": None}, {"nt": "2"}, {"nt": -1}, {"nt": 9}, {"nt": 2}, {}]
+  results = Gmx.simulate_many(specs, cores = 4)
+
+  assert results[0] == (4, 0)
+  assert results[1] == (4, 0)
+  for i in [2, 3, 4]:
+    assert isinstance(results[i], ValueError)
+  assert results[5][0] == 2
+  assert results[6][0] == 1
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from utils.gmx import gmx as Gmx
+from test_edr import edr_file
+
+
+def rerun(monkeypatch, tmp_path, steps):
+  """ Swaps grompp and mdrun for a rerun that writes one energy frame per
+      step in steps, with the step number as its Potential.
+  """
+  edr = tmp_path / "sp.edr"
+  edr.write_bytes(edr_file([(s, float(s), [0.0, 10.0 * s, 300.0]) for s in steps]))
+  monkeypatch.setattr(Gmx, "grompp", lambda **kwargs: None)
+  monkeypatch.setattr(Gmx, "mdrun", lambda **kwargs: {"e": str(edr)})
+
+  confs = []
+  for i in range(4):
+    conf = tmp_path / "conf{}.gro".format(i)
+    conf.write_text("conf {}\n1\n    1SOL     OW    1   0.000   0.000   0.000\n   1.0   1.0   1.0\n".format(i))
+    confs.append(str(conf))
+  return dict(name = str(tmp_path / "sp"), mdp = "sp.mdp", top = "sp.top", confs = confs, executable = "gmx")
+
+
+def test_energies_follow_the_frame_steps(monkeypatch, tmp_path):
+  kwargs = rerun(monkeypatch, tmp_path, [2, 0, 1, 3])
+  assert np.allclose(Gmx.sp_many(**kwargs), [0, 10, 20, 30])
+
+  kwargs = rerun(monkeypatch, tmp_path, [0, 1, 3])
+  with pytest.raises(ValueError, match = r"configurations \[2\]"):
+    Gmx.sp_many(**kwargs)
+
+  kwargs = rerun(monkeypatch, tmp_path, [100, 200])
+  with pytest.raises(ValueError, match = "2 energy frames for 4 configurations"):
+    Gmx.sp_many(**kwargs)
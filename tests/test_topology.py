@@ -0,0 +1,40 @@
+import os
+import pickle
+
+from utils.gmx import gmx as Gmx
+
+
+def fake_install(tmp_path):
+  """ A gmx executable with a force field in its share/gromacs/top, and a
+      topology that includes it.
+  """
+  exe = tmp_path / "gromacs" / "bin" / "gmx"
+  ff  = tmp_path / "gromacs" / "share" / "gromacs" / "top" / "oplsaa.ff"
+  os.makedirs(exe.parent)
+  os.makedirs(ff)
+  exe.write_text("#!/bin/sh\n")
+  exe.chmod(0o755)
+  (ff / "forcefield.itp").write_text('#include "ffnonbonded.itp"\n')
+  (ff / "ffnonbonded.itp").write_text("[ atomtypes ]\n")
+
+  work = tmp_path / "work"
+  os.makedirs(work)
+  (work / "topol.top").write_text('#include "oplsaa.ff/forcefield.itp"\n\n[ system ]\nx\n')
+  return str(exe), str(ff), str(work / "topol.top")
+
+
+def test_includes_resolve_in_the_executable_share_dir(tmp_path):
+  exe, ff, top = fake_install(tmp_path)
+  assert Gmx._top_includes(top, exe) == [top, os.path.join(ff, "forcefield.itp"),
+                                         os.path.join(ff, "ffnonbonded.itp")]
+
+
+def test_load_top_keys_on_force_field_files(tmp_path, monkeypatch):
+  exe, ff, top = fake_install(tmp_path)
+  keyed = []
+  monkeypatch.setattr(Gmx, "_base_cmd", lambda: exe)
+  monkeypatch.setattr(Gmx.Cache, "file_key", lambda *paths, extra: keyed.extend(paths) or "key")
+  monkeypatch.setitem(Gmx._top_memo, "key", pickle.dumps("parsed"))
+
+  assert Gmx.load_top(top) == "parsed"
+  assert os.path.join(ff, "ffnonbonded.itp") in keyed
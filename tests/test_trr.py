@@ -0,0 +1,60 @@
+import os
+import struct
+import numpy as np
+
+from utils.gmx.objects.trr import trr as Trr
+
+
+def trr_frame(step, time, x, v = None, box = None, real = 4):
+  """ One trr frame as gmx writes it: header, then box, x and v. """
+  dtype = ">f{}".format(real)
+  n     = len(x)
+  sizes = [0, 0, 9 * real if box is not None else 0, 0, 0, 0, 0, 3 * n * real,
+           3 * n * real if v is not None else 0, 0, n, step, 0]
+  out   = struct.pack(">iii", 1993, 13, 12) + b"GMX_trn_file" + struct.pack(">13i", *sizes)
+  out  += np.array([time, 0.0], dtype).tobytes()
+  for block in [box, x, v]:
+    if block is not None:
+      out += np.asarray(block, dtype).tobytes()
+  return out
+
+
+def coords(seed, n = 4):
+  return np.random.default_rng(seed).uniform(0, 3, size = (n, 3)).astype(np.float32)
+
+
+def test_reads_frames_and_subsets(tmp_path):
+  path = tmp_path / "traj.trr"
+  box  = np.eye(3) * 3.0
+  path.write_bytes(trr_frame(0, 0.0, coords(0), coords(1), box) +
+                   trr_frame(100, 0.2, coords(2), None, box))
+
+  traj = Trr(str(path))
+  assert len(traj) == 2
+  assert traj.frame(1).step == 100 and np.isclose(traj.frame(1).time, 0.2)
+  assert np.array_equal(traj.frame(0).x, coords(0))
+  assert np.array_equal(traj.frame(0).v, coords(1))
+  assert traj.frame(1).v is None
+  assert np.allclose(traj.frame(0).box, box)
+  assert np.array_equal(traj.read("x", atoms = [2, 4]), np.stack([coords(0), coords(2)])[:, [1, 3]])
+
+
+def test_double_precision(tmp_path):
+  path = tmp_path / "double.trr"
+  x    = np.random.default_rng(3).uniform(0, 3, size = (5, 3))
+  path.write_bytes(trr_frame(7, 1.5, x, box = np.eye(3), real = 8))
+  frame = Trr(str(path)).frame(0)
+  assert frame.step == 7 and np.array_equal(frame.x, x)
+
+
+def test_file_rewritten_in_place_is_reindexed(tmp_path):
+  path = tmp_path / "run.trr"
+  path.write_bytes(b"".join(trr_frame(i, 0.1 * i, coords(i), box = np.eye(3)) for i in range(3)))
+  assert len(Trr(str(path))) == 3
+  assert os.path.isfile(str(path) + ".idx.npy")
+
+  # A new run with the same name: more atoms, so the old offsets land mid-frame
+  path.write_bytes(b"".join(trr_frame(i, 0.1 * i, coords(10 + i, n = 8), box = np.eye(3)) for i in range(4)))
+  traj = Trr(str(path))
+  assert len(traj) == 4
+  assert np.array_equal(traj.frame(3).x, coords(13, n = 8))
@@ -0,0 +1,66 @@
+import os
+import sys
+import pytest
+
+pytest.importorskip("fileParser")
+
+from utils.gmx import gmx as Gmx
+from utils.gmx import tune as Tune
+from conftest import ROOT
+
+STANDIN = "{} {}".format(sys.executable, os.path.join(ROOT, "benchmarks", "gmx_standin.py"))
+CORES   = os.cpu_count()
+
+# The stand-in runs 4x slower with twice as many threads as cores, and 1.5x
+#  slower with -nb gpu, so the full node on the CPU should win by far
+GRID = {"nt": [2 * CORES, CORES], "nb": ["gpu", None]}
+
+
+@pytest.fixture
+def tpr(tmp_path, monkeypatch):
+  monkeypatch.setenv("GMXTOOLS_CACHE", str(tmp_path / "cache"))
+  monkeypatch.setenv("GMX_STANDIN_SCALE", "2e-5")
+  path = tmp_path / "topol.tpr"
+  path.write_bytes(b"system")
+  return str(path)
+
+
+def test_grid_search(tpr):
+  result = Tune.tune_mdrun(tpr, grid = GRID, executable = STANDIN)
+  assert result.best == {"nt": CORES}
+  assert len(result.trials) == 4
+  assert all(t["error"] is None and len(t["runs"]) == 1 for t in result.trials)
+  assert result.ns_per_day == max(t["ns_per_day"] for t in result.trials)
+  assert os.path.isfile(os.path.join(os.environ["GMXTOOLS_CACHE"], "tune", result.key + ".json"))
+
+
+def test_adaptive_search(tpr):
+  # One flag at a time from the first values; the second pass retries nt
+  #  with the better nb, then finds nothing to improve
+  result = Tune.tune_mdrun(tpr, grid = GRID, search = "adaptive", repeats = 2, executable = STANDIN)
+  assert result.best == {"nt": CORES}
+  assert [t["flags"] for t in result.trials] == [{"nt": 2 * CORES, "nb": "gpu"}, {"nt": CORES, "nb": "gpu"},
+                                                 {"nt": CORES, "nb": None}, {"nt": 2 * CORES, "nb": None}]
+  assert all(len(t["runs"]) == 2 for t in result.trials)
+
+  with pytest.raises(ValueError, match = "Unknown search"):
+    Tune.tune_mdrun(tpr, grid = GRID, search = "random", executable = STANDIN, retune = True)
+
+
+def test_results_are_reused_per_fingerprint(tpr, tmp_path, monkeypatch):
+  first = Tune.tune_mdrun(tpr, grid = GRID, executable = STANDIN)
+  assert first.key == Tune.fingerprint(tpr, STANDIN)
+
+  # Stored results are returned without running mdrun again
+  with monkeypatch.context() as m:
+    m.setattr(Gmx, "mdrun", lambda **kwargs: pytest.fail("mdrun ran again"))
+    again = Tune.tune_mdrun(tpr, grid = GRID, executable = STANDIN)
+  assert again.best == first.best and again.trials == first.trials
+
+  # A different system, or retune, runs the trials again
+  other = tmp_path / "other.tpr"
+  other.write_bytes(b"other system")
+  assert Tune.tune_mdrun(str(other), grid = GRID, executable = STANDIN).key != first.key
+  retuned = Tune.tune_mdrun(tpr, grid = {"nt": [CORES]}, executable = STANDIN, retune = True)
+  assert retuned.key == first.key and len(retuned.trials) == 1
+  assert Tune.tune_mdrun(tpr, executable = STANDIN).trials == retuned.trials
@@ -0,0 +1,24 @@
+import os
+import numpy as np
+
+from utils.gmx.objects.xtc import xtc as Xtc
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+# reference.xtc was written with mdtraj (xdrfile); reference_xtc.npy holds the
+#  coordinates xdrfile decodes from it. Frame 0 is water-like (runs of small
+#  deltas), frame 1 spans 5000 nm (the packed triple needs over 64 bits) and
+#  frame 2 spans 20000 nm (coordinates stored one by one).
+
+
+def test_frames_match_xdrfile_bit_for_bit():
+  traj = Xtc(os.path.join(DATA, "reference.xtc"), index = False)
+  ref  = np.load(os.path.join(DATA, "reference_xtc.npy"))
+
+  assert len(traj) == 3
+  assert [traj.frame(i).step for i in range(3)] == [0, 5000, 10000]
+  assert np.allclose([traj.frame(i).time for i in range(3)], [0.0, 10.0, 20.0])
+  for i in range(3):
+    assert np.array_equal(traj.frame(i).x, ref[i])
+  assert np.array_equal(traj.read(processes = 2), ref)
+  assert np.array_equal(traj.read(atoms = [1, 60], processes = 1), ref[:, [0, 59]])
@@ -0,0 +1,79 @@
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip("fileParser")
+
+from utils.gmx import xvg as Xvg
+
+
+def write_xvg(path, times):
+  with open(path, 'w') as f:
+    f.write('@    title "Energies"\n@    xaxis  label "Time (ps)"\n@ s0 legend "Potential"\n')
+    for t in times:
+      f.write("{:10.3f} {:10.3f}\n".format(t, 10 * t))
+  return str(path)
+
+
+def test_rows_are_aligned_by_time(tmp_path):
+  a = write_xvg(tmp_path / "a.xvg", [0, 1, 2, 3, 4])
+  b = write_xvg(tmp_path / "b.xvg", [0, 1, 2])
+
+  panel = Xvg.load_many([a, b], processes = 1)
+  assert panel.misaligned == []
+  assert np.allclose(panel.time, [0, 1, 2, 3, 4])
+  assert np.isnan(panel.data[1, 3:]).all()
+
+  c = write_xvg(tmp_path / "c.xvg", [0, 2, 4, 6])
+  panel = Xvg.load_many([a, b, c], processes = 1)
+  assert panel.misaligned == [c]
+  assert np.allclose(panel.time, [0, 1, 2, 3, 4, 6])
+  assert np.allclose(panel.data[2, [0, 2, 4, 5], 0], [0, 20, 40, 60])
+  assert np.isnan(panel.data[2, [1, 3], 0]).all()
+
+
+def test_empty_file_is_padded(tmp_path):
+  a = write_xvg(tmp_path / "a.xvg", [0, 1, 2])
+  e = write_xvg(tmp_path / "e.xvg", [])
+
+  for columns in [None, [1]]:
+    panel = Xvg.load_many([a, e], columns = columns, processes = 1)
+    assert panel.lengths == {a: 3, e: 0}
+    assert panel.mismatched == {e: 0}
+    assert panel.misaligned == []
+    assert np.allclose(panel.data[0, :, 0], [0, 10, 20])
+    assert np.isnan(panel.data[1]).all()
+
+  with pytest.raises(ValueError, match = "any data"):
+    Xvg.load_many([e], processes = 1)
+
+def test_columns_match_full_parse(tmp_path):
+  rows = np.column_stack([np.arange(50) * 0.5, np.linspace(-1e4, 1e4, 50), np.cos(np.arange(50))])
+  fixed = tmp_path / "fixed.xvg"
+  with open(fixed, 'w') as f:
+    f.write('@ s0 legend "a"\n@ s1 legend "b"\n')
+    np.savetxt(f, rows, fmt = "%12.6f", delimiter = "  ")
+  ragged = tmp_path / "ragged.xvg"
+  with open(ragged, 'w') as f:
+    f.write('@ s0 legend "a"\n')
+    np.savetxt(f, rows, fmt = "%g")
+
+  for path in [str(fixed), str(ragged)]:
+    offset = Xvg.parse_header(path)["offset"]
+    full   = Xvg.parse_data(path, offset)
+    assert np.array_equal(Xvg.parse_columns(path, offset, [2, 0]), full[:, [2, 0]])
+
+
+def test_lazy_load_writes_the_sidecar(tmp_path):
+  path  = write_xvg(tmp_path / "a.xvg", [0, 1, 2])
+  cache = str(tmp_path / "cache")
+
+  lazy = Xvg.xvg(path, cache = cache, lazy = True)
+  assert not os.path.isdir(cache) or not os.listdir(cache)
+  assert np.allclose(lazy.data[:, 1], [0, 10, 20])
+  assert sorted(os.path.splitext(p)[1] for p in os.listdir(cache)) == [".json", ".npy"]
+
+  again = Xvg.xvg(path, cache = cache, lazy = True)
+  assert isinstance(again.data, np.memmap)
+  assert again.labels == lazy.labels
+  assert np.array_equal(again.data, lazy.data)
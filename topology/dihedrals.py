@@ -1,9 +1,9 @@
-import parmed
 import os
 import numpy as np
 from ..gmx import load_top, load_gro
 from fileParser import make_parents, File
 from ..objects import mdp as Mdp
+from ..objects import ndx as Ndx
 
 # ---------------------------------------------------------------------------- #
 # ---------------------------------------------------------------------------- #
@@ -114,6 +114,7 @@ def zero_dihedrals(topfile, d_lists, path):
 # ---------------------------------------------------------------------------- #
 
 def __zero_dihedral(top, d_idxs):
+  import parmed
 
   # Load file and atoms
   assert type(top) is parmed.gromacs.GromacsTopologyFile
@@ -171,7 +172,7 @@ def restrain_dihedrals(topfile, grofile, d_lists, path, force = -10 ** 7):
 
   # Load files
   top = load_top(topfile)
-  gro = load_gro(grofile)
+  gro = load_gro(grofile, parmed = True)
 
   # Instantiate restrained dihedrals.
   for d_list in d_lists:
@@ -185,6 +186,7 @@ def restrain_dihedrals(topfile, grofile, d_lists, path, force = -10 ** 7):
 # ---------------------------------------------------------------------------- #
 
 def __add_restraint(top, gro, d_list, force = -10 ** 7):
+  import parmed
 
   assert force < 0
   assert all(type(i) is int for i in d_list) and len(d_list) == 4
@@ -209,7 +211,7 @@ def __add_restraint(top, gro, d_list, force = -10 ** 7):
 def freeze_dihedral(mdpfile, d_list, path = None):
   """ Freezes atoms involved in the dihedral d_list. """
 
-  if path.endswith(".mdp") or path.endswith(".ndx"):
+  if path and (path.endswith(".mdp") or path.endswith(".ndx")):
     path = os.path.splitext(path)[0]
 
   if not path:
@@ -224,9 +226,9 @@ def freeze_dihedral(mdpfile, d_list, path = None):
   mdp.write(mdp_frozen)
 
   ndx_frozen = path + ".ndx"
-  with open(ndx_frozen, 'w+') as f:
-    f.write("[ dih_frozen ]\n")
-    f.write(" {} {} {} {}\n\n".format(*d_list))
+  groups = Ndx()
+  groups.dih_frozen = d_list
+  groups.write(ndx_frozen)
 
   return mdp_frozen, ndx_frozen
  
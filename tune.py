@@ -0,0 +1,160 @@
+# mdrun throughput tuning. Short fixed-step trials are run over mdrun flag
+#  settings (thread count, domain decomposition, nonbonded placement, ...),
+#  the ns/day of each is read from its log, and the best setting is kept per
+#  system fingerprint so later runs of the same system can reuse it.
+
+import os
+import json
+import shutil
+import socket
+import tempfile
+import itertools
+from . import gmx as Gmx
+from . import cache as Cache
+from .objects.misc import AttributeDict
+
+# ---------------------------------------------------------------------------- #
+
+def default_grid(cores = None):
+  """ A small search space for a node with cores cores: the full node, half
+      and a quarter of it, with and without a tighter -dds.
+  """
+  cores = cores if cores else os.cpu_count()
+  nt    = sorted({cores, cores // 2, cores // 4} - {0}, reverse = True)
+  return {"nt": nt, "dds": [None, 0.9], "pforce": [None], "nb": [None]}
+
+
+def fingerprint(tpr, executable = None):
+  """ Identifies a system on a machine: the tpr contents, the executable
+      and the host (name and core count).
+  """
+  extra = "{}:{}:{}".format(executable, socket.gethostname(), os.cpu_count())
+  return Cache.file_key(tpr, extra = extra)
+
+
+def tune_mdrun(tpr, grid = None, search = "grid", nsteps = 2000, repeats = 1,
+               executable = None, key = None, retune = False, workdir = None,
+               keep = False, **kwargs):
+  """ Finds the fastest mdrun settings for tpr.
+      grid maps mdrun flags to the values to try (default_grid() if None;
+      None as a value leaves the flag unset). search = "grid" tries every
+      combination; "adaptive" optimizes one flag at a time, holding the
+      others at their best values so far, until no flag improves. Each trial
+      runs nsteps steps (counters reset halfway, no output configuration),
+      repeats times, and is scored by its median ns/day. Extra kwargs are
+      passed to every mdrun call.
+      executable may be any gmx-like program, e.g. a stand-in that mimics
+      gmx output and timing (see benchmarks/gmx_standin.py).
+      The result is stored under the system fingerprint (key, or
+      fingerprint(tpr, executable)) and returned from there on later calls
+      unless retune. Returns an AttributeDict with best (the flags to pass
+      to mdrun/simulate), ns_per_day, trials and key.
+  """
+
+  assert os.path.isfile(tpr), "No file found at path {}".format(tpr)
+  executable = executable if executable else Gmx._base_cmd()
+
+  key  = key if key else fingerprint(tpr, executable)
+  path = os.path.join(Cache.cache_dir("tune"), key + ".json")
+  if not retune and os.path.isfile(path):
+    with open(path) as f:
+      stored = json.load(f)
+    result = AttributeDict()
+    for k, v in stored.items():
+      result[k] = v
+    return result
+
+  grid    = grid if grid else default_grid()
+  workdir = workdir if workdir else tempfile.mkdtemp(prefix = "gmx_tune_")
+  trials  = []
+
+  def trial(flags):
+    """ Runs (or looks up) one setting and returns its ns/day. """
+    for t in trials:
+      if t["flags"] == flags:
+        return t["ns_per_day"]
+    record = _trial(tpr, flags, len(trials), workdir, nsteps, repeats, executable, kwargs)
+    trials.append(record)
+    return record["ns_per_day"]
+
+  try:
+    if search == "grid":
+      names = list(grid)
+      for values in itertools.product(*(grid[n] for n in names)):
+        trial(dict(zip(names, values)))
+    elif search == "adaptive":
+      _coordinate_search(grid, trial)
+    else:
+      raise ValueError("Unknown search {}; use grid or adaptive.".format(search))
+  finally:
+    if not keep:
+      shutil.rmtree(workdir, ignore_errors = True)
+
+  scored = [t for t in trials if t["ns_per_day"] is not None]
+  if not scored:
+    raise ValueError("No mdrun trial of {} succeeded: {}".format(tpr, trials[0]["error"] if trials else ""))
+  best = max(scored, key = lambda t: t["ns_per_day"])
+
+  result = AttributeDict()
+  result.key        = key
+  result.tpr        = os.path.abspath(tpr)
+  result.best       = {k: v for k, v in best["flags"].items() if v is not None}
+  result.ns_per_day = best["ns_per_day"]
+  result.trials     = trials
+
+  with open(path + ".tmp", 'w') as f:
+    json.dump(result, f, indent = 1)
+  os.replace(path + ".tmp", path)
+
+  return result
+
+# ---------------------------------------------------------------------------- #
+
+def _trial(tpr, flags, n, workdir, nsteps, repeats, executable, kwargs):
+  """ Runs one setting repeats times. Returns its trial record. """
+
+  record = {"flags": flags, "runs": [], "ns_per_day": None, "error": None}
+  for r in range(repeats):
+    deffnm = os.path.join(workdir, "trial{}_{}".format(n, r))
+    Gmx._materialize(tpr, deffnm + ".tpr")
+    args = {k: v for k, v in flags.items() if v is not None}
+    args.update(kwargs)
+    try:
+      files = Gmx.mdrun(s = deffnm + ".tpr", deffnm = deffnm, nsteps = nsteps,
+                        resethway = True, confout = False, overwrite = True,
+                        executable = executable, log = deffnm + ".txt", **args)
+    except (Gmx.GROMACSInputError, Gmx.GROMACSFatalError) as e:
+      record["error"] = str(e)
+      break
+    perf = files["performance"]
+    if not perf or perf["ns_per_day"] is None:
+      record["error"] = "no performance data in {}".format(files["g"])
+      break
+    record["runs"].append(perf["ns_per_day"])
+
+  if record["error"] is None and record["runs"]:
+    runs = sorted(record["runs"])
+    record["ns_per_day"] = runs[len(runs) // 2]
+  return record
+
+
+def _coordinate_search(grid, trial, max_rounds = 5):
+  """ Improves one flag at a time from the first value of each, until a full
+      pass over the flags changes nothing.
+  """
+
+  current = {name: values[0] for name, values in grid.items()}
+  best    = trial(dict(current))
+  for round_ in range(max_rounds):
+    improved = False
+    for name, values in grid.items():
+      for value in values:
+        if value == current[name]:
+          continue
+        candidate = dict(current, **{name: value})
+        score     = trial(candidate)
+        if score is not None and (best is None or score > best):
+          current, best, improved = candidate, score, True
+    if not improved:
+      break
+  return current, best
@@ -1,65 +1,146 @@
 from fileParser import File
 import numpy as np
+import os
+import re
+import json
+import glob
+from concurrent.futures import ProcessPoolExecutor
+from . import cache as Cache
+from .objects.misc import AttributeDict
 from sys import exit
-import matplotlib.pyplot as plt
 
 class xvg(File):
-  
-  def __init__(self, fp, mode = 'r'):
+
+  def __init__(self, fp, mode = 'r', cache = False, max_bytes = Cache.MAX_BYTES,
+               lazy = False):
+    """ cache = True (or a directory) stores the parsed file in a binary
+        sidecar and memory-maps it on later loads instead of reparsing.
+        lazy = True only reads the header; data is parsed on first access
+        (and then written to the sidecar if caching), and columns() parses
+        just the requested columns.
+    """
     super().__init__(fp, mode)
+    self._fp      = fp
+    self._data    = None
+    self._columns = {}
+    self._cache   = None
 
-    # Gather mandatory data
-    self.title = self.advance_to("title")[11:]
-    x = self.advance_to("xaxis", hold_all = True, tf = lambda x: x[18:].strip("\n").replace('"',''))[0]
-    self.labels = [x.split()[0]]
-    try:
-      self.units = [x.split()[1].replace("(", "").replace(")","")]
-      self.units += self.advance_to("yaxis", hold_all = True, tf = self.clean_units)[0]
-    except IndexError:
-      self.units = None
-    self.axtype = self.advance_to("TYPE")[6:]
-    self.data = []
-
-    # Gather optional data, halting at onset of data
-    self.advance_to(["subtitle", "legend"])[11:]
-    self.subtitle = self.cl[11:] if "subtitle" in self.cl else ""
-    self.advance_to(["^@ s0", "^ "])
-    if self.cl.startswith("@"):
-      self.labels += self.advance_to("^ ", hold_all = True, tf = lambda x: x[12:].strip("\n").replace('"',''),
-                                        include_first = True, exclude = True)
-    else:
-      self.labels = None     
+    if cache:
+      cdir = cache if type(cache) is str else Cache.cache_dir("xvg")
+      if self._load_cached(fp, cdir):
+        return
+      self._cache = (cdir, max_bytes)
+
+    # Gather header data, remembering where the data blocks start
+    header = parse_header(fp)
+    self.title    = header["title"]
+    self.subtitle = header["subtitle"]
+    self.labels   = header["labels"]
+    self.units    = header["units"]
+    self.axtype   = header["axtype"]
+    self.offset   = header["offset"]
+
+    if lazy:
+      return
+
+    # Gather data in bulk
+    self.data = parse_data(fp, self.offset)
 
-    # Gather data
-    n_frames = 0
-    while self.cl:
-      n_frames += 1
-      
-      # add in extra dimension if needed (or stack)
-      self.data.append(np.array(self.advance_to("&", hold_all = True, include_first = True,
-                        tf = lambda x: [float(i) for i in x.strip("\n").split()],
-                        quiet = True)))
+    if self._cache:
+      self._write_cache(fp, *self._cache)
 
-    if n_frames == 1:
-      self.data = self.data[0]
 
+  @property
+  def data(self):
+    if self._data is None:
+      self._data = parse_data(self._fp, self.offset)
+      if self._cache:
+        self._write_cache(self._fp, *self._cache)
+    return self._data
 
-  def plot(self, labels = None):
+  @data.setter
+  def data(self, val):
+    self._data = val
+
+  def columns(self, *labels):
+    """ Returns the requested columns (by label or index) stacked along the
+        last axis. If the data isn't loaded, rows in gmx's fixed-width
+        layout have only those fields converted; other layouts are parsed in
+        full and projected, which saves memory but not time.
+    """
+    idxs = [self.labels.index(l) if type(l) is str else l for l in labels]
+
+    if self._data is not None:
+      return self._data[..., idxs]
+
+    missing = [i for i in idxs if i not in self._columns]
+    if missing:
+      for i, col in zip(missing, np.moveaxis(parse_columns(self._fp, self.offset, missing), -1, 0)):
+        self._columns[i] = col
+    return np.stack([self._columns[i] for i in idxs], axis = -1)
+
+  def plot(self, labels = None, lod = True, out = None):
+    """ lod = True decimates each series to about the figure's pixel width
+        (keeping per-bucket extremes) and resamples it when zooming.
+        If out is given the figure is saved there instead of shown.
+    """
+    import matplotlib.pyplot as plt # slow to import; only needed here
     plt.figure()
+    line = _plot_lod if lod else lambda ax, x, y, **kw: ax.plot(x, y, **kw)
+    ax = plt.gca()
     if labels is None:
       if self.units:
         for i, (lab, u) in enumerate(zip(self.labels, self.units)):
           if lab == "Time": continue
-          plt.plot(self.data[:, 0], self.data[:, i], label = "{} [{}]".format(lab, u)) 
+          line(ax, self.data[:, 0], self.data[:, i], label = "{} [{}]".format(lab, u))
     else:
       if type(labels) is str: labels = [labels]
       for lab in labels:
         i = self.labels.index(lab) # Will raise ValueError if lab not in self.labels
-        plt.plot(self.data[:, 0], self.data[:, i], label = "{} [{}]".format(lab, self.units[i])) 
+        line(ax, self.data[:, 0], self.data[:, i], label = "{} [{}]".format(lab, self.units[i]))
     plt.xlabel("Time [ps]")
     plt.legend()
-    plt.show()
-    
+    if out:
+      plt.savefig(out)
+      plt.close()
+    else:
+      plt.show()
+
+  def _cache_paths(self, fp, cdir):
+    key = Cache.file_key(fp)
+    return os.path.join(cdir, key + ".npy"), os.path.join(cdir, key + ".json")
+
+  def _load_cached(self, fp, cdir):
+    """ Fills in the object from a sidecar, if a valid one exists. """
+    npy, meta = self._cache_paths(fp, cdir)
+    if not (os.path.isfile(npy) and os.path.isfile(meta)):
+      return False
+
+    with open(meta) as f:
+      for key, val in json.load(f).items():
+        setattr(self, key, val)
+    self.data = np.load(npy, mmap_mode = 'r')
+    Cache.touch(npy, meta)
+    return True
+
+  def _write_cache(self, fp, cdir, max_bytes):
+    if type(self.data) is list:
+      return # ragged sets don't fit in a single array
+
+    os.makedirs(cdir, exist_ok = True)
+    npy, meta = self._cache_paths(fp, cdir)
+    fields = ["title", "subtitle", "labels", "units", "axtype", "offset"]
+
+    # Write to temporary names first so concurrent readers never see half a file
+    with open(npy + ".tmp", 'wb') as f:
+      np.save(f, self.data)
+    with open(meta + ".tmp", 'w') as f:
+      json.dump({key: getattr(self, key) for key in fields}, f)
+    os.replace(npy + ".tmp", npy)
+    os.replace(meta + ".tmp", meta)
+
+    Cache.evict(cdir, max_bytes)
+
   @staticmethod
   def clean_units(u):
     """ cleans up the unit from the xvg file """
@@ -69,3 +150,359 @@ class xvg(File):
       u = u.replace(s, '')
     return u.split()
 
+# ---------------------------------------------------------------------------- #
+
+def decimate(x, y, n_buckets = 1000, xlim = None):
+  """ Min/max-per-bucket decimation for plotting: splits the (visible part of
+      the) series into n_buckets and keeps each bucket's lowest and highest
+      point, so spikes survive. x must be sorted.
+  """
+
+  lo, hi = 0, len(x)
+  if xlim is not None:
+    lo = max(int(np.searchsorted(x, xlim[0])) - 1, 0)
+    hi = min(int(np.searchsorted(x, xlim[1])) + 1, len(x))
+  x, y = x[lo:hi], y[lo:hi]
+
+  if len(x) <= 2 * n_buckets:
+    return x, y
+
+  size = len(x) // n_buckets
+  n    = size * n_buckets
+  yb   = np.asarray(y[:n]).reshape(n_buckets, size)
+  base = np.arange(n_buckets) * size
+  idx  = np.stack([base + yb.argmin(axis = 1), base + yb.argmax(axis = 1)], axis = 1)
+  idx.sort(axis = 1)
+  idx  = [[0], idx.ravel()]
+
+  if n < len(x):
+    tail = np.asarray(y[n:])
+    idx.append(np.sort([n + tail.argmin(), n + tail.argmax()]))
+  idx.append([len(x) - 1])
+
+  idx = np.concatenate(idx)
+  return x[idx], y[idx]
+
+
+def _plot_lod(ax, x, y, **kwargs):
+  """ Plots a decimated series that is resampled whenever the x range changes. """
+
+  n_buckets = int(ax.figure.get_figwidth() * ax.figure.dpi)
+  line, = ax.plot(*decimate(x, y, n_buckets), **kwargs)
+
+  def update(ax):
+    line.set_data(*decimate(x, y, n_buckets, xlim = ax.get_xlim()))
+
+  ax.callbacks.connect("xlim_changed", update)
+  return line
+
+# ---------------------------------------------------------------------------- #
+
+class xvg_tail(object):
+  """ Incremental reader for an xvg file that is still being written. Each
+      refresh() returns only the rows appended since the last call, leaving a
+      partially written last line for next time.
+  """
+
+  def __init__(self, fp):
+    self.path   = fp
+    self.offset = None # byte offset of the first unread data byte
+    self.n_cols = None
+    self.n_sets = 0    # '&' separators seen so far
+    self.labels, self.units, self.title = None, None, ""
+
+  def _read_header(self):
+    if not os.path.isfile(self.path):
+      return False
+    header = parse_header(self.path)
+    if os.path.getsize(self.path) <= header["offset"]:
+      return False # no data yet, so the header may still be incomplete
+    self.labels = header["labels"]
+    self.units  = header["units"]
+    self.title  = header["title"]
+    self.offset = header["offset"]
+    return True
+
+  def refresh(self):
+    """ Returns the newly appended complete rows as a (n_new, n_cols) array. """
+
+    if self.offset is None and not self._read_header():
+      return np.empty((0, self.n_cols or 0))
+
+    if os.path.getsize(self.path) < self.offset:
+      # file was truncated or rewritten (e.g. a restart without -append)
+      self.offset, self.n_cols, self.n_sets = None, None, 0
+      return self.refresh()
+
+    with open(self.path, 'rb') as f:
+      f.seek(self.offset)
+      chunk = f.read()
+
+    end = chunk.rfind(b"\n") + 1
+    if not end:
+      return np.empty((0, self.n_cols or 0))
+    self.offset += end
+
+    text = chunk[:end]
+    if b"&" in text:
+      self.n_sets += text.count(b"\n&") + text.startswith(b"&")
+      text = re.sub(rb"^&.*\n", b"", text, flags = re.M)
+    text = _strip_comments(text)
+    if not text.strip():
+      return np.empty((0, self.n_cols or 0))
+
+    shape = _block_shape(text)
+    self.n_cols = self.n_cols or shape[1]
+    return _parse_block(text, (shape[0], self.n_cols))
+
+# ---------------------------------------------------------------------------- #
+
+def load_many(paths, columns = None, processes = None):
+  """ Parses many xvg files across a process pool and aligns them into one
+      panel. paths is a list or a glob pattern; columns are labels or indices
+      to keep (default: everything but time).
+
+      Rows are aligned by time value. If every file's time column is a
+      prefix of the longest one's, that is the shared time axis; otherwise
+      it is the sorted union of all time values, and the files that forced
+      this are listed in misaligned.
+
+      Returns an AttributeDict with the shared time axis, data as a
+      NaN-padded (n_files, n_rows, n_cols) array, the per-file lengths, the
+      files whose length differs from the longest and the misaligned files.
+  """
+
+  if type(paths) is str:
+    paths = sorted(glob.glob(paths))
+  if not paths:
+    raise ValueError("No xvg files to load.")
+
+  with ProcessPoolExecutor(max_workers = processes) as pool:
+    results = list(pool.map(_load_one, paths, [columns] * len(paths)))
+
+  # Files with a header but no data rows have no column count to check;
+  # they keep length 0 and come out as all-NaN rows.
+  n_cols = set(d.shape[1] - 1 for _, d in results if d.size)
+  if not n_cols:
+    raise ValueError("None of the xvg files hold any data.")
+  if len(n_cols) > 1:
+    raise ValueError("xvg files have differing numbers of columns: {}".format(sorted(n_cols)))
+
+  lengths = [d.shape[0] if d.size else 0 for _, d in results]
+  longest = int(np.argmax(lengths))
+  times   = [d[:, 0] if d.size else np.empty(0) for _, d in results]
+  time    = times[longest]
+
+  misaligned = [p for p, t in zip(paths, times) if not np.allclose(t, time[:len(t)])]
+  if misaligned:
+    time = np.unique(np.concatenate(times))
+
+  data = np.full((len(paths), len(time), n_cols.pop()), np.nan)
+  for i, (_, d) in enumerate(results):
+    if not d.size:
+      continue
+    rows = np.searchsorted(time, d[:, 0]) if misaligned else slice(0, d.shape[0])
+    data[i, rows] = d[:, 1:]
+
+  panel            = AttributeDict()
+  panel.paths      = list(paths)
+  panel.labels     = results[longest][0][1:] if results[longest][0] else None
+  panel.time       = time
+  panel.data       = data
+  panel.lengths    = dict(zip(paths, lengths))
+  panel.mismatched = {p: n for p, n in zip(paths, lengths) if n != max(lengths)}
+  panel.misaligned = misaligned
+
+  return panel
+
+
+def _load_one(path, columns = None):
+  """ Worker for load_many. Returns the labels kept and a (n_rows, 1 + k)
+      array whose first column is time.
+  """
+
+  header = parse_header(path)
+  labels = header["labels"]
+
+  if columns is None:
+    data = parse_data(path, header["offset"])
+  else:
+    idxs = [0] + [labels.index(c) if type(c) is str else c for c in columns]
+    data = parse_columns(path, header["offset"], idxs)
+    labels = [labels[i] for i in idxs] if labels else None
+
+  if type(data) is list or data.ndim != 2:
+    raise ValueError("{} holds several data sets; load_many expects one.".format(path))
+
+  return labels, data
+
+# ---------------------------------------------------------------------------- #
+
+def parse_header(fp):
+  """ Reads the '#' and '@' lines at the top of an xvg file. Returns a dict
+      with the title, subtitle, labels, units and axis type, plus the byte
+      offset at which the numeric data starts.
+  """
+
+  header = {"title": "", "subtitle": "", "labels": None, "units": None,
+            "axtype": "", "offset": 0}
+  xaxis, yaxis, legends = None, None, []
+
+  with open(fp, 'rb') as f:
+    offset = 0
+    for raw in f:
+      if not raw.startswith((b"#", b"@")):
+        break
+      offset += len(raw)
+      line = raw.decode()
+
+      if line.startswith("@TYPE"):
+        header["axtype"] = line[6:]
+      elif re.match(r"@\s+subtitle", line):
+        header["subtitle"] = line[11:]
+      elif re.match(r"@\s+title", line):
+        header["title"] = line[11:]
+      elif re.match(r"@\s+xaxis\s+label", line):
+        xaxis = line[18:].strip("\n").replace('"', '')
+      elif re.match(r"@\s+yaxis\s+label", line):
+        yaxis = xvg.clean_units(line)
+      elif re.match(r"@ s\d+ legend", line):
+        legends.append(line.split("legend", 1)[1].strip().replace('"', ''))
+
+  header["offset"] = offset
+
+  if xaxis:
+    header["labels"] = [xaxis.split()[0]]
+    try:
+      header["units"] = [xaxis.split()[1].replace("(", "").replace(")", "")]
+      header["units"] += yaxis if yaxis else []
+    except IndexError:
+      header["units"] = None
+
+  if legends:
+    header["labels"] = (header["labels"] or []) + legends
+  else:
+    header["labels"] = None
+
+  return header
+
+# ---------------------------------------------------------------------------- #
+
+def parse_data(fp, offset = 0):
+  """ Parses the numeric blocks of an xvg file in bulk, starting at the byte
+      offset returned by parse_header. Sets separated by '&' lines come back
+      as one contiguous (n_sets, n_rows, n_cols) array; a single set comes
+      back as (n_rows, n_cols). Sets of differing shapes are returned as a
+      list of 2D arrays.
+  """
+
+  blocks = _read_blocks(fp, offset)
+  shapes = [_block_shape(b) for b in blocks]
+
+  if not blocks:
+    return np.empty((0, 0))
+
+  if len(set(shapes)) > 1:
+    return [_parse_block(b, s) for b, s in zip(blocks, shapes)]
+
+  # Preallocate the output and fill it set by set
+  data = np.empty((len(blocks),) + shapes[0], dtype = np.float64)
+  for i, (block, shape) in enumerate(zip(blocks, shapes)):
+    data[i] = _parse_block(block, shape)
+
+  if len(blocks) == 1:
+    data = data[0]
+
+  return data
+
+
+def parse_columns(fp, offset = 0, cols = (0,)):
+  """ Like parse_data, but only allocates the columns in cols, and only
+      converts them if the rows are fixed-width (see _parse_block_columns).
+  """
+
+  blocks = [_parse_block_columns(b, cols) for b in _read_blocks(fp, offset)]
+
+  if not blocks:
+    return np.empty((0, len(cols)))
+  if len(set(b.shape for b in blocks)) > 1:
+    return blocks
+  if len(blocks) == 1:
+    return blocks[0]
+  return np.stack(blocks)
+
+
+def _read_blocks(fp, offset):
+  """ Splits the bytes after offset into '&'-separated sets. Blocks stay
+      bytes, which numpy parses without a decoded copy.
+  """
+
+  with open(fp, 'rb') as f:
+    f.seek(offset)
+    text = f.read()
+
+  blocks = re.split(rb"^&.*$", text, flags = re.M) if b"&" in text else [text]
+  return [_strip_comments(b) for b in blocks if b and not b.isspace()]
+
+
+def _strip_comments(block):
+  """ Drops '@' and '#' lines (e.g. '@target G0.S1') found between sets. """
+  if b"@" not in block and b"#" not in block:
+    return block
+  return b"".join(l for l in block.splitlines(True) if not l.lstrip().startswith((b"@", b"#")))
+
+
+def _block_shape(block):
+  """ Rows and columns of a block, judged from its first line. """
+  start, stop = _extent(block)
+  eol    = block.find(b"\n", start, stop)
+  n_cols = len(block[start:eol if eol != -1 else stop].split())
+  n_rows = block.count(b"\n", start, stop) + 1
+  return (n_rows, n_cols)
+
+
+def _extent(block):
+  """ Offsets of the start of the first non-blank line and the end of the
+      last one's text, found without copying the block.
+  """
+  text  = re.match(rb"\s*", block).end()
+  start = block.rfind(b"\n", 0, text) + 1
+  stop  = len(block)
+  while stop > start and block[stop - 1] in b" \t\r\n":
+    stop -= 1
+  return start, stop
+
+
+def _parse_block(block, shape):
+  data = np.fromstring(block, dtype = np.float64, sep = " ")
+  if data.size != shape[0] * shape[1]:
+    raise ValueError("Malformed xvg data block: expected {} values, read {}.".format(
+                     shape[0] * shape[1], data.size))
+  return data.reshape(shape)
+
+
+def _parse_block_columns(block, cols):
+  """ Columns cols of a block as an (n_rows, len(cols)) array. gmx writes
+      fixed-width rows, so the block is viewed as a 2D byte array and only
+      the requested fields are converted. Other layouts are parsed in full
+      and projected.
+  """
+
+  shape       = _block_shape(block)
+  start, stop = _extent(block)
+  width       = block.find(b"\n", start) - start + 1
+  if width > 0 and start + shape[0] * width == stop + 1 and block[stop:stop + 1] == b"\n":
+    rows = np.frombuffer(block, np.uint8, shape[0] * width, start).reshape(shape[0], width)
+    if (rows[:, -1] == ord("\n")).all():
+      # Fields are the runs of byte columns that hold a character in any row
+      used   = np.concatenate([[False], (rows[:, :-1] != ord(" ")).any(axis = 0), [False]])
+      bounds = np.flatnonzero(used[1:] != used[:-1]).reshape(-1, 2)
+      if len(bounds) == shape[1]:
+        out = np.empty((shape[0], len(cols)), dtype = np.float64)
+        for j, c in enumerate(cols):
+          a, b  = bounds[c]
+          field = np.ascontiguousarray(rows[:, a:b]).view("S{}".format(b - a)).ravel()
+          out[:, j] = field.astype(np.float64)
+        return out
+
+  return _parse_block(block, shape)[:, list(cols)]